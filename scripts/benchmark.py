@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+import mock_llm_server
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_SITUATIONS = [
+    "A patient refuses a blood transfusion on religious grounds during emergency surgery.",
+    "A family asks doctors to withhold a terminal diagnosis from an elderly parent.",
+    "A hospital must allocate its last ventilator between two critically ill patients.",
+    "A teenager requests contraception without parental consent.",
+    "A physician considers reporting a colleague who appears impaired at work.",
+]
+_COUNTRIES = ["United States", "China", "India", "Brazil", "Nigeria", "Germany"]
+
+
+def _question(i: int) -> str:
+    return f"{_SITUATIONS[i % len(_SITUATIONS)]} What should be done? A. Intervene B. Defer C. Seek a compromise"
+
+
+def overton_item(i: int) -> Dict[str, Any]:
+    return {"id": i, "situation": _SITUATIONS[i % len(_SITUATIONS)],
+            "vrd": [{"vrd": "Value", "text": "Autonomy"}, {"vrd": "Duty", "text": "Duty of care"}],
+            "explanation": "Synthetic benchmark item."}
+
+
+def steerable_generate_item(i: int) -> Dict[str, Any]:
+    return {"id": i, "situation": _SITUATIONS[i % len(_SITUATIONS)], "input": _question(i),
+            "vrd": "Autonomy", "label_text": "supports", "label": 0}
+
+
+def option_item(i: int) -> Dict[str, Any]:
+    return {"id": i, "question": _question(i), "options": ["Intervene", "Defer", "Seek a compromise"],
+            "attribute": _COUNTRIES[i % len(_COUNTRIES)], "gold_distribution": [0.5, 0.3, 0.2],
+            "pred_distribution": None}
+
+
+SCRIPTS = {
+    "overton": ("generate_overton_comments.py", overton_item),
+    "steerable_generate": ("generate_steerable_comments_generate.py", steerable_generate_item),
+    "steerable_probability": ("generate_steerable_comments_probability.py", option_item),
+    "distributional_moral": ("generate_distributional_comments_moral_scenarios.py", option_item),
+    "distributional_poll": ("generate_distributional_comments_poll_questions.py", option_item),
+}
+
+
+def run_script(name: str, num_items: int, base_url: str, workdir: str, extra_args: List[str]) -> Dict[str, Any]:
+    script, make_item = SCRIPTS[name]
+    input_path = os.path.join(workdir, f"{name}_input.json")
+    stats_path = os.path.join(workdir, f"{name}_stats.json")
+    with open(input_path, 'w') as f:
+        json.dump([make_item(i) for i in range(num_items)], f)
+
+    with open(os.path.join(workdir, f"{name}.log"), 'w') as log:
+        started = time.monotonic()
+        proc = subprocess.Popen([sys.executable, os.path.join(SCRIPTS_DIR, script), "--input", input_path,
+                                 "--base-url", base_url, "--stats-out", stats_path] + extra_args,
+                                cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.monotonic() - started
+
+    result = {"script": name, "exit_code": proc.returncode, "items": num_items, "seconds": round(elapsed, 3),
+              "items_per_sec": round(num_items / elapsed, 2), "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1)}
+    if os.path.exists(stats_path):
+        with open(stats_path) as f:
+            run_stats = json.load(f)
+        counters = run_stats["counters"]
+        result["peak_child_rss_mb"] = round(run_stats["peak_child_rss_kb"] / 1024, 1)
+        result["startup_seconds"] = run_stats.get("gauges", {}).get("startup_seconds")
+        result["checkpoint_bytes"] = counters.get("checkpoint_bytes", 0)
+        result["export_bytes"] = counters.get("export_bytes", 0)
+        result["latency"] = run_stats["percentiles"]
+        result["counters"] = counters
+    return result
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    lines = [f"{result['script']}: exit={result['exit_code']} {result['items']} items in {result['seconds']}s "
+             f"({result['items_per_sec']} items/s), ready after {result.get('startup_seconds')}s, "
+             f"peak RSS {result['peak_rss_mb']} MB"
+             f" (children {result.get('peak_child_rss_mb', 0)} MB), "
+             f"checkpoint {result.get('checkpoint_bytes', 0)} B, export {result.get('export_bytes', 0)} B"]
+    for name, quantiles in sorted(result.get("latency", {}).items()):
+        formatted = ", ".join(f"{q}={value * 1000:.0f}ms" for q, value in quantiles.items() if value is not None)
+        lines.append(f"    {name}: {formatted}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark of the generate_* scripts "
+                                                 "against the mock LLM server")
+    parser.add_argument("--scripts", nargs="*", default=list(SCRIPTS), choices=list(SCRIPTS))
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--latency-mean", type=float, default=0.2)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--short-seed-rate", type=float, default=0.0)
+    parser.add_argument("--workdir", default=None, help="keep inputs, outputs and logs here instead of a temp dir")
+    parser.add_argument("--json-out", default=None, help="write the results as JSON for regression comparisons")
+    parser.add_argument("script_args", nargs=argparse.REMAINDER,
+                        help="arguments after -- are passed to every script, e.g. -- --engine mp --workers 64")
+    args = parser.parse_args()
+    script_args = args.script_args[1:] if args.script_args[:1] == ["--"] else args.script_args
+
+    config = mock_llm_server.MockConfig(args.latency_mean, args.latency_sigma, args.error_rate,
+                                        args.throttle_rate, args.short_seed_rate)
+    server = mock_llm_server.serve("127.0.0.1", 0, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = args.workdir or tmpdir
+        os.makedirs(workdir, exist_ok=True)
+        for name in args.scripts:
+            result = run_script(name, args.items, base_url, workdir, script_args)
+            print(format_result(result))
+            results.append(result)
+
+    server.shutdown()
+    print(f"Mock server handled {config.requests} requests")
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_WORDS = ("patient autonomy consent family physician nurse risk benefit trust harm care duty dignity privacy "
+          "treatment outcome culture religion community law evidence values respect fairness burden hope").split()
+_COUNTRIES = ["United States", "China", "India", "Brazil", "Nigeria", "Germany"]
+_STAKEHOLDERS = ["Patient", "Nurse", "Physician", "Family member", "Ethicist", "Administrator"]
+
+
+def synthetic_record(i: int, num_comments: int, comment_chars: int, text: str, rng: random.Random) -> Dict[str, Any]:
+    question = f"Situation {i % 5000}: should the care team follow the family's request? A. Yes B. No C. Unsure"
+    comments = []
+    for index in range(num_comments):
+        start = rng.randrange(len(text) - comment_chars)
+        seed = f"A {rng.choice(_WORDS)}-minded person from {_COUNTRIES[i % len(_COUNTRIES)]}, " \
+               f"{_STAKEHOLDERS[index % len(_STAKEHOLDERS)]}"
+        comments.append({"seed": seed, "comment": [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": f"You are {seed}. {question}"},
+            {"role": "assistant", "content": "ABC"[rng.randrange(3)] + ". " + text[start:start + comment_chars]},
+        ]})
+    return {"id": i, "question": question, "options": ["Yes", "No", "Unsure"],
+            "attribute": _COUNTRIES[i % len(_COUNTRIES)], "gold_distribution": [0.5, 0.3, 0.2],
+            "pred_distribution": None, "comments": comments}
+
+
+def write_checkpoint(path: str, num_items: int, num_comments: int, comment_chars: int, seed: int = 0) -> int:
+    """Writes a deterministic checkpoint of distributional records and returns its size in bytes."""
+    rng = random.Random(seed)
+    text = " ".join(rng.choice(_WORDS) for _ in range(max(4 * comment_chars, 100000)))
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(num_items):
+            f.write(json.dumps(synthetic_record(i, num_comments, comment_chars, text, rng), ensure_ascii=False) + "\n")
+    return os.path.getsize(path)
+
+
+def run_export(checkpoint_path: str, output_path: str, batch_rows: int) -> Dict[str, Any]:
+    started = time.monotonic()
+    proc = subprocess.Popen([sys.executable, os.path.join(SCRIPTS_DIR, "export_parquet.py"), checkpoint_path,
+                             output_path, "--batch-rows", str(batch_rows)],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    output = proc.stdout.read()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.monotonic() - started
+    return {"batch_rows": batch_rows, "exit_code": os.waitstatus_to_exitcode(status), "seconds": round(elapsed, 2),
+            "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1), "output": output.strip()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time export_parquet.py on a generated checkpoint")
+    parser.add_argument("--items", type=int, default=200000)
+    parser.add_argument("--comments", type=int, default=6, help="comments per item (one Parquet row each)")
+    parser.add_argument("--comment-chars", type=int, default=1800, help="characters per generated comment reply")
+    parser.add_argument("--batch-rows", type=int, nargs="+", default=[8192, 65536])
+    parser.add_argument("--workdir", default=None, help="keep the checkpoint and Parquet files here")
+    parser.add_argument("--json-out", default=None, help="write the results as JSON for regression comparisons")
+    args = parser.parse_args()
+
+    results: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = args.workdir or tmpdir
+        os.makedirs(workdir, exist_ok=True)
+        checkpoint_path = os.path.join(workdir, "export_bench.jsonl")
+        size = write_checkpoint(checkpoint_path, args.items, args.comments, args.comment_chars)
+        print(f"Checkpoint: {args.items} items, {args.items * args.comments} comments, {size / 1e9:.2f} GB")
+        for batch_rows in args.batch_rows:
+            result = run_export(checkpoint_path, os.path.join(workdir, f"export_bench_{batch_rows}.parquet"),
+                                batch_rows)
+            print(f"--batch-rows {batch_rows}: exit={result['exit_code']} {result['seconds']}s, "
+                  f"peak RSS {result['peak_rss_mb']} MB ({result['output']})")
+            results.append(result)
+
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(results, f, indent=4)
+    if any(result["exit_code"] for result in results):
+        sys.exit(1)
@@ -0,0 +1,415 @@
+import argparse
+import glob
+import io
+import json
+import os
+import re
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import input_reader
+import result_index
+import stats
+import telemetry
+
+_SHARD_SUFFIX = re.compile(r'\.shard-\d+-of-\d+\.jsonl$')
+
+
+def checkpoint_path(output_path: str) -> str:
+    root, _ = os.path.splitext(output_path)
+    return root + ".jsonl"
+
+
+def zstd_output_path(output_path: str) -> str:
+    root, _ = os.path.splitext(output_path)
+    return root + ".jsonl.zst"
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd containers need the zstandard package: pip install zstandard")
+    return zstandard
+
+
+def shard_output_path(output_path: str, shard: Optional[Tuple[int, int]]) -> str:
+    if shard is None:
+        return output_path
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+
+def shard_checkpoint_paths(output_path: str) -> List[str]:
+    root, _ = os.path.splitext(output_path)
+    return sorted(p for p in glob.glob(glob.escape(root) + ".shard-*-of-*.jsonl") if _SHARD_SUFFIX.search(p))
+
+
+def is_error_record(record: Dict[str, Any]) -> bool:
+    return 'error' in record or record.get('comments') == ["Error occurred"]
+
+
+def dead_letter_path(path: str) -> str:
+    root, _ = os.path.splitext(path)
+    return root + ".failed.jsonl"
+
+
+def journal_path(path: str) -> str:
+    root, _ = os.path.splitext(path)
+    return root + ".partial.jsonl"
+
+
+def segment_paths(path: str) -> List[str]:
+    rotated = [p for p in glob.glob(glob.escape(path) + ".*") if p.rsplit(".", 1)[1].isdigit()]
+    rotated.sort(key=lambda p: int(p.rsplit(".", 1)[1]))
+    if os.path.exists(path):
+        rotated.append(path)
+    return rotated
+
+
+def _fsync_dir(path: str):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _truncate_partial_tail(path: str):
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+        pos = size
+        while pos > 0:
+            step = min(65536, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step)
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                f.truncate(pos + newline + 1)
+                return
+        f.truncate(0)
+
+
+class JsonlCheckpoint:
+    def __init__(self, path: str, fsync_every: int = 10, max_bytes: Optional[int] = None, verbose: bool = False,
+                 index: bool = True):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+        self.written = 0
+        self._unsynced = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        _truncate_partial_tail(path)
+        self._index = result_index.IndexWriter(path, segment_paths(path)) if index else None
+        self._file = open(path, 'a', encoding='utf-8')
+        self._offset = os.path.getsize(path)
+
+    def append(self, record: Dict[str, Any]):
+        with telemetry.span("checkpoint_append"):
+            line = json.dumps(record, ensure_ascii=False) + "\n"
+            length = len(line.encode("utf-8"))
+            self._file.write(line)
+            if self._index is not None:
+                self._index.add(record.get('id'), self._offset, length)
+            self._offset += length
+            stats.incr("checkpoint_bytes", length)
+            self.written += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                self.flush()
+            if self.max_bytes is not None and self._offset >= self.max_bytes:
+                self.rotate()
+
+    def flush(self):
+        if not self._unsynced:
+            return
+        with telemetry.span("checkpoint_fsync"):
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        if self._index is not None:
+            self._index.flush()
+        self._unsynced = 0
+        if self.verbose:
+            print(f"Saved progress: {self.written} new items")
+
+    def rotate(self):
+        self.flush()
+        self._file.close()
+        segments = segment_paths(self.path)
+        next_index = int(segments[-2].rsplit(".", 1)[1]) + 1 if len(segments) > 1 else 1
+        os.replace(self.path, f"{self.path}.{next_index}")
+        _fsync_dir(self.path)
+        if self._index is not None:
+            self._index.rotated(next_index)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._offset = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        if self._index is not None:
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ReplacementSink:
+    """Collects retried records and swaps the successful ones into the checkpoint in one atomic rewrite."""
+
+    def __init__(self, path: str, verbose: bool = False):
+        self.path = path
+        self.pending = JsonlCheckpoint(path + ".retry", verbose=verbose, index=False)
+        self.replaced = 0
+
+    def append(self, record: Dict[str, Any]):
+        self.pending.append(record)
+
+    def close(self):
+        self.pending.close()
+        self.replaced = replace_records(self.path, self.pending.path)
+        os.remove(self.pending.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_sink(path: str, retry_failed: bool = False, verbose: bool = False, max_bytes: Optional[int] = None):
+    if retry_failed:
+        return ReplacementSink(path, verbose=verbose)
+    return JsonlCheckpoint(path, max_bytes=max_bytes, verbose=verbose)
+
+
+class DeadLetterLog:
+    """Appends one line per failed item with the exception, attempts and timing, numbering attempts across runs."""
+
+    def __init__(self, path: str):
+        self.path = dead_letter_path(path)
+        self.attempts: Dict[Any, int] = {}
+        for record in iter_records(self.path):
+            self.attempts[record.get('id')] = record.get('total_attempts', 0)
+        self._file = None
+
+    def append(self, failure: Dict[str, Any]):
+        total = self.attempts.get(failure['id'], 0) + failure.get('attempts', 1)
+        self.attempts[failure['id']] = total
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(dict(failure, total_attempts=total, time=time.time()), ensure_ascii=False) + "\n")
+        self._file.flush()
+        stats.incr("dead_letters")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def compact(self, keep_ids: Set[Any]):
+        self.close()
+        kept = [line.encode('utf-8') for line in _iter_lines(self.path) if _failure_id(line) in keep_ids]
+        if kept:
+            rewrite(self.path, kept)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        self.attempts = {item_id: total for item_id, total in self.attempts.items() if item_id in keep_ids}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _failure_id(line: str) -> Any:
+    try:
+        return json.loads(line).get('id')
+    except (json.JSONDecodeError, AttributeError):
+        return None
+
+
+def _iter_lines(path: str) -> Iterator[str]:
+    for segment in segment_paths(path):
+        with open(segment, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.endswith("\n"):
+                    yield line
+
+
+def iter_line_offsets(path: str) -> Iterator[Tuple[str, int, bytes]]:
+    for segment in segment_paths(path):
+        with open(segment, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.endswith(b"\n"):
+                    yield segment, offset, line
+                offset += len(line)
+
+
+def iter_records(path: str) -> Iterator[Dict[str, Any]]:
+    for line in _iter_lines(path):
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            continue
+
+
+def iter_zstd_records(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, 'rb') as f, _zstandard().ZstdDecompressor().stream_reader(f) as reader:
+        for line in io.TextIOWrapper(reader, encoding='utf-8'):
+            if line.endswith("\n"):
+                yield json.loads(line)
+
+
+def iter_results(path: str) -> Iterator[Dict[str, Any]]:
+    if path.endswith(".zst"):
+        return iter_zstd_records(path)
+    if path.endswith(".jsonl"):
+        return iter_records(path)
+    if segment_paths(checkpoint_path(path)):
+        return iter_records(checkpoint_path(path))
+    return input_reader.iter_items(path)
+
+
+def open_index(path: str) -> result_index.ResultIndex:
+    return result_index.ResultIndex(path, segment_paths(path))
+
+
+def scan_ids(path: str) -> Set[Any]:
+    with open_index(path) as index:
+        return set(index.ids())
+
+
+def scan_failed_ids(path: str) -> Set[Any]:
+    ids = set()
+    for line in _iter_lines(path):
+        if '"Error occurred"' not in line and '"error"' not in line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if is_error_record(record):
+            ids.add(record.get('id'))
+    return ids
+
+
+def rewrite(path: str, lines: Iterable[bytes]):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        for line in lines:
+            f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+    stale = [segment for segment in segment_paths(path) if segment != path]
+    if os.path.exists(result_index.index_path(path)):
+        os.remove(result_index.index_path(path))
+    os.replace(tmp_path, path)
+    for segment in stale:
+        os.remove(segment)
+    _fsync_dir(path)
+
+
+def replace_records(path: str, replacement_path: str) -> int:
+    replacements = {}
+    for line in _iter_lines(replacement_path):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if not is_error_record(record):
+            replacements[record.get('id')] = line.encode('utf-8')
+    if not replacements:
+        return 0
+
+    def lines():
+        for _, _, line in iter_line_offsets(path):
+            try:
+                item_id = result_index.line_id(line.decode('utf-8'))
+            except (json.JSONDecodeError, AttributeError):
+                yield line
+                continue
+            yield replacements.get(item_id, line)
+
+    rewrite(path, lines())
+    return len(replacements)
+
+
+def import_legacy(json_path: str, path: str, shard: Optional[Tuple[int, int]] = None) -> int:
+    if segment_paths(path) or not os.path.exists(json_path):
+        return 0
+    try:
+        with open(json_path, 'r') as f:
+            results = json.load(f)
+    except json.JSONDecodeError:
+        return 0
+    results = [result for result in results if input_reader.in_shard(result.get('id'), shard)]
+    with JsonlCheckpoint(path, fsync_every=len(results) or 1) as sink:
+        for result in results:
+            sink.append(result)
+    return len(results)
+
+
+def export_json(path: str, output_path: str) -> int:
+    tmp_path = output_path + ".tmp"
+    count = 0
+    with telemetry.span("export"), open(tmp_path, 'w') as f:
+        f.write("[")
+        for record in iter_records(path):
+            f.write(",\n" if count else "\n")
+            f.write("    " + json.dumps(record, indent=4).replace("\n", "\n    "))
+            count += 1
+        f.write("\n]" if count else "]")
+        f.flush()
+        stats.incr("export_bytes", f.tell())
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def export_zstd(path: str, output_path: str, level: int = 10) -> int:
+    tmp_path = output_path + ".tmp"
+    count = 0
+    with telemetry.span("export"), open(tmp_path, 'wb') as f:
+        with _zstandard().ZstdCompressor(level=level).stream_writer(f, closefd=False) as writer:
+            for line in _iter_lines(path):
+                writer.write(line.encode('utf-8'))
+                count += 1
+        stats.incr("export_bytes", f.tell())
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def export(path: str, output_path: str, compress: str = "none") -> int:
+    if compress == "zstd":
+        return export_zstd(path, zstd_output_path(output_path))
+    return export_json(path, output_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a JSONL checkpoint as a pretty-printed JSON array")
+    parser.add_argument("checkpoint")
+    parser.add_argument("output")
+    parser.add_argument("--zstd", action="store_true", help="write a zstd-compressed JSONL container instead")
+    args = parser.parse_args()
+
+    if args.zstd:
+        print(f"Exported {export_zstd(args.checkpoint, args.output)} records to {args.output}")
+    else:
+        print(f"Exported {export_json(args.checkpoint, args.output)} records to {args.output}")
@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import checkpoint
+
+ModelSpec = Tuple[str, Optional[str]]
+GenerateModel = Callable[[str, str, Any], Awaitable[Dict[str, Any]]]
+
+
+def parse_model(value: str) -> ModelSpec:
+    model, _, api_key_env = value.partition("=")
+    if not model:
+        raise argparse.ArgumentTypeError(f"expected MODEL or MODEL=API_KEY_ENV, got {value!r}")
+    return model, api_key_env or None
+
+
+def add_model_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--comment-models", nargs="+", type=parse_model, default=None, metavar="MODEL[=API_KEY_ENV]",
+                        help="generate the seeds once and comment with every listed model; results are stored per "
+                             "model under 'models' in each record (API_KEY_ENV defaults to the script's comment key)")
+
+
+def check_args(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    names = [model for model, _ in args.comment_models or ()]
+    if len(set(names)) != len(names):
+        parser.error(f"--comment-models lists a model more than once: {' '.join(names)}")
+
+
+def resolve(specs: Optional[List[ModelSpec]], default_api_key_env: str) -> Optional[List[Tuple[str, str]]]:
+    if specs is None:
+        return None
+    return [(model, api_key_env or default_api_key_env) for model, api_key_env in specs]
+
+
+async def fan_out(models: Optional[List[Tuple[str, str]]], default: Tuple[str, str], journal: Any,
+                  generate: GenerateModel) -> Dict[str, Any]:
+    if models is None:
+        return await generate(*default, journal)
+    outputs = await asyncio.gather(*(generate(model, api_key_env, journal.for_model(model))
+                                     for model, api_key_env in models))
+    return {"models": {model: output for (model, _), output in zip(models, outputs)}}
+
+
+def select(record: Dict[str, Any], model: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    models = record.get('models')
+    if not isinstance(models, dict):
+        return record
+    if model is None:
+        model = next(iter(models), None)
+    if model not in models:
+        return None
+    view = dict(record, **models[model], model=model)
+    del view['models']
+    return view
+
+
+def views(record: Dict[str, Any]) -> Iterator[Tuple[Optional[str], Dict[str, Any]]]:
+    models = record.get('models')
+    if not isinstance(models, dict):
+        yield None, record
+        return
+    for model in models:
+        yield model, select(record, model)
+
+
+def selecting(records: Iterable[Dict[str, Any]], model: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    for record in records:
+        view = select(record, model)
+        if view is not None:
+            yield view
+
+
+def model_names(records: Iterable[Dict[str, Any]]) -> List[str]:
+    for record in records:
+        if checkpoint.is_error_record(record):
+            continue
+        return list(record['models']) if isinstance(record.get('models'), dict) else []
+    return []
@@ -0,0 +1,137 @@
+import argparse
+import functools
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import sys
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import checkpoint
+import comment_models
+
+BuildMessages = Callable[..., List[Dict[str, str]]]
+CommentVars = Callable[[Dict[str, Any]], Dict[str, Any]]
+ProcessItem = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+def add_output_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--output-format", choices=["full", "compact"], default="full",
+                        help="full: every comment keeps its system/user/assistant messages; compact: only the reply, "
+                             "plus one template id and its variables per item to rebuild the prompts")
+    parser.add_argument("--compress", choices=["none", "zstd"], default="none",
+                        help="zstd: export a zstd-compressed JSONL container (<output>.jsonl.zst) instead of the "
+                             "pretty-printed JSON array")
+    parser.add_argument("--checkpoint-max-bytes", type=int, default=None, metavar="BYTES",
+                        help="rotate the JSONL checkpoint to <checkpoint>.1, .2, ... once it reaches this size; "
+                             "resume, export and the offset index read every segment")
+
+
+def check_args(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    if args.compress == "zstd":
+        try:
+            checkpoint._zstandard()
+        except ImportError as e:
+            parser.error(f"--compress zstd: {e}")
+
+
+def _module_name(build: BuildMessages) -> str:
+    if build.__module__ != "__main__":
+        return build.__module__
+    return os.path.splitext(os.path.basename(sys.modules["__main__"].__file__))[0]
+
+
+def fingerprint(build: BuildMessages) -> str:
+    placeholders = {name: "{%s}" % name for name in inspect.signature(build).parameters}
+    rendered = json.dumps(build(**placeholders), sort_keys=True).encode("utf-8")
+    return hashlib.sha1(rendered).hexdigest()[:12]
+
+
+def template_id(build: BuildMessages) -> str:
+    return f"{_module_name(build)}.{build.__name__}@{fingerprint(build)}"
+
+
+@functools.lru_cache(maxsize=None)
+def resolve(template: str) -> BuildMessages:
+    name, _, digest = template.partition("@")
+    module, _, function = name.rpartition(".")
+    build = getattr(importlib.import_module(module), function)
+    if fingerprint(build) != digest:
+        raise ValueError(f"prompt template {name} changed since {template} was written; "
+                         f"the stored replies cannot be paired with the current prompts")
+    return build
+
+
+def _compact_comments(comments: List[Any], build: BuildMessages, variables: Dict[str, Any]) -> Tuple[List[Any], bool]:
+    compact = []
+    compacted = False
+    for comment in comments or []:
+        messages = comment.get('comment') if isinstance(comment, dict) else None
+        if (isinstance(messages, list) and messages and messages[-1].get('role') == 'assistant'
+                and messages[:-1] == build(**variables, personality=comment.get('seed'))):
+            comment = dict(comment, comment=messages[-1]['content'])
+            compacted = True
+        compact.append(comment)
+    return compact, compacted
+
+
+def compact_record(record: Dict[str, Any], build: BuildMessages, variables: Dict[str, Any],
+                   template: str) -> Dict[str, Any]:
+    if isinstance(record.get('models'), dict):
+        models, compacted = {}, False
+        for model, output in record['models'].items():
+            comments, done = _compact_comments(output.get('comments'), build, variables)
+            models[model] = dict(output, comments=comments)
+            compacted = compacted or done
+        compact = dict(record, models=models)
+    else:
+        comments, compacted = _compact_comments(record.get('comments'), build, variables)
+        compact = dict(record, comments=comments)
+    if not compacted:
+        return record
+    return dict(compact, comment_prompt={"template": template, "vars": variables})
+
+
+async def _compact_item(process_item: ProcessItem, build: BuildMessages, comment_vars: CommentVars, template: str,
+                        item: Dict[str, Any]) -> Dict[str, Any]:
+    return compact_record(await process_item(item), build, comment_vars(item), template)
+
+
+def compacting(process_item: ProcessItem, build: BuildMessages, comment_vars: CommentVars) -> ProcessItem:
+    return functools.partial(_compact_item, process_item, build, comment_vars, template_id(build))
+
+
+def _messages(prompt: Optional[Dict[str, Any]], comment: Any) -> Any:
+    if prompt is None or not isinstance(comment, dict) or not isinstance(comment.get('comment'), str):
+        return comment.get('comment') if isinstance(comment, dict) else comment
+    messages = resolve(prompt['template'])(**prompt['vars'], personality=comment.get('seed'))
+    messages.append({"role": "assistant", "content": comment['comment']})
+    return messages
+
+
+def comment_messages(record: Dict[str, Any], index: int, model: Optional[str] = None) -> Any:
+    return _messages(record.get('comment_prompt'), comment_models.select(record, model)['comments'][index])
+
+
+def _expand_comments(prompt: Dict[str, Any], comments: List[Any]) -> List[Any]:
+    return [dict(comment, comment=_messages(prompt, comment)) if isinstance(comment, dict) else comment
+            for comment in comments or []]
+
+
+def expand_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    if 'comment_prompt' not in record:
+        return record
+    prompt = record['comment_prompt']
+    if isinstance(record.get('models'), dict):
+        expanded = dict(record, models={model: dict(output, comments=_expand_comments(prompt, output.get('comments')))
+                                        for model, output in record['models'].items()})
+    else:
+        expanded = dict(record, comments=_expand_comments(prompt, record['comments']))
+    del expanded['comment_prompt']
+    return expanded
+
+
+def load(path: str, expand: bool = True) -> Iterator[Dict[str, Any]]:
+    for record in checkpoint.iter_results(path):
+        yield expand_record(record) if expand else record
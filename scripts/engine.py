@@ -0,0 +1,500 @@
+import argparse
+import asyncio
+import atexit
+import collections
+import functools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import checkpoint
+import comment_models
+import compact_schema
+import input_reader
+import item_journal
+import joint_comments
+import llm
+import option_scoring
+import rate_limit
+import retry
+import seed_planner
+import stats
+import telemetry
+import transcript
+
+ProcessItem = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+MakeError = Callable[[Dict[str, Any], Exception], Dict[str, Any]]
+OnResult = Callable[[Dict[str, Any]], None]
+OnFailure = Callable[[Dict[str, Any]], None]
+
+# Workers send their counters, histograms and current gauges this often while an item runs,
+# so live metrics do not wait for the item to finish.
+_REPORT_INTERVAL = 1.0
+_REPORT = "report"
+
+
+def add_engine_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--engine", choices=["async", "mp"], default="async",
+                        help="async: one event loop with bounded in-flight requests; mp: one process per worker")
+    parser.add_argument("--concurrency", type=int, default=256,
+                        help="maximum items in flight for the async engine; with --base-url requests are plain "
+                             "asyncio sockets, so this is bounded by --max-requests and the provider limits only")
+    parser.add_argument("--workers", type=int, default=64,
+                        help="number of worker processes for the mp engine")
+    parser.add_argument("--start-method", choices=mp.get_all_start_methods(), default=None,
+                        help="how the mp engine starts workers (default: the platform default, fork on Linux); "
+                             "spawn and forkserver workers re-apply these engine options on start")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help="bound on queued items and results for the mp engine (default: 2 x workers)")
+    parser.add_argument("--max-requests", type=int, default=1024,
+                        help="maximum LLM requests in flight per process")
+    parser.add_argument("--request-threads", type=int, default=64,
+                        help="threads per process for blocking work: oai_client calls (not used with --base-url) "
+                             "and --cache reads and writes; calls beyond this wait for a free thread")
+    parser.add_argument("--provider-concurrency", nargs="*", default=[], metavar="PROVIDER=N",
+                        help="ceiling for the adaptive per-provider concurrency, e.g. qwen=32 deepseek=8; "
+                             "with --engine mp it is split evenly across workers (at least 1 each)")
+    parser.add_argument("--rpm", nargs="*", default=[], metavar="PROVIDER=N",
+                        help="requests-per-minute budget per provider for the whole run; "
+                             "with --engine mp each worker gets an even share")
+    parser.add_argument("--tpm", nargs="*", default=[], metavar="PROVIDER=N",
+                        help="estimated tokens-per-minute budget per provider for the whole run; "
+                             "with --engine mp each worker gets an even share")
+    parser.add_argument("--request-max-attempts", type=int, default=6,
+                        help="attempts per LLM request when the provider returns 429 or 5xx")
+    parser.add_argument("--base-url", default=None,
+                        help="send requests to this OpenAI-compatible endpoint instead of oai_client (e.g. a mock server)")
+    parser.add_argument("--stats-out", default=None, metavar="PATH",
+                        help="write run counters, latency percentiles and peak RSS as JSON")
+    parser.add_argument("--trace", default=None, metavar="PATH",
+                        help="record per-stage spans and write them as a Chrome trace (chrome://tracing, Perfetto)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve live counters, gauges and latency histograms at http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--cache", default=None, metavar="PATH",
+                        help="SQLite file caching LLM responses across runs")
+    parser.add_argument("--cache-max-entries", type=int, default=None)
+    parser.add_argument("--cache-max-age-days", type=float, default=None)
+    parser.add_argument("--record", default=None, metavar="PATH",
+                        help="append every LLM request and response to this JSONL transcript")
+    parser.add_argument("--replay", default=None, metavar="PATH",
+                        help="serve LLM responses from a recorded transcript instead of the network")
+    parser.add_argument("--seed-max-attempts", type=int, default=5,
+                        help="seed persona requests per item before giving up")
+    parser.add_argument("--seed-top-up", action="store_true",
+                        help="keep parsed seed groups from a short response and request only the missing ones")
+    parser.add_argument("--retry-base-delay", type=float, default=1.0)
+    parser.add_argument("--retry-max-delay", type=float, default=30.0)
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="reprocess only the items recorded as errors in the checkpoint and replace their placeholders")
+    parser.add_argument("--retry-concurrency", type=int, default=16,
+                        help="items in flight (async) or worker processes (mp) during --retry-failed")
+    parser.add_argument("--retry-item-attempts", type=int, default=3,
+                        help="attempts per item during --retry-failed, with backoff between them")
+
+
+def _parse_provider_limits(specs: List[str], share: int = 1) -> Dict[str, float]:
+    limits = {}
+    for spec in specs:
+        provider, _, limit = spec.partition("=")
+        limits[provider.lower()] = float(limit) / share
+    return limits
+
+
+def _request_processes(args: argparse.Namespace) -> int:
+    if args.engine != "mp":
+        return 1
+    return args.retry_concurrency if args.retry_failed else args.workers
+
+
+def configure_process(args: argparse.Namespace):
+    llm.set_request_threads(args.request_threads)
+    llm.set_base_url(args.base_url)
+    if args.trace:
+        telemetry.enable_tracing()
+    share = _request_processes(args)
+    max_concurrency = {provider: max(1, int(limit))
+                       for provider, limit in _parse_provider_limits(args.provider_concurrency, share).items()}
+    rate_limit.configure(max_concurrency, rpm=_parse_provider_limits(args.rpm, share),
+                         tpm=_parse_provider_limits(args.tpm, share), default_concurrency=args.max_requests)
+    llm.configure_cache(args.cache, max_entries=args.cache_max_entries, max_age_days=args.cache_max_age_days,
+                        run_id=getattr(args, "cache_run_id", None))
+    llm.configure_transcript(record=args.record, replay=args.replay)
+    retry.configure_requests(retry.RetryPolicy(max_attempts=args.request_max_attempts, base_delay=args.retry_base_delay,
+                                               max_delay=args.retry_max_delay))
+    retry.configure_seeds(retry.RetryPolicy(max_attempts=args.seed_max_attempts, base_delay=args.retry_base_delay,
+                                            max_delay=args.retry_max_delay), top_up=args.seed_top_up)
+
+
+def configure(args: argparse.Namespace):
+    # Minted once here so spawn and forkserver workers share the parent's cache run and never
+    # claim each other's sampling slots as hits.
+    args.cache_run_id = uuid.uuid4().hex
+    configure_process(args)
+    if args.stats_out:
+        atexit.register(stats.write, args.stats_out)
+    if args.trace:
+        atexit.register(telemetry.write_trace, args.trace)
+    if args.metrics_port is not None:
+        telemetry.serve_metrics(args.metrics_port)
+
+
+def _failure(item: Dict[str, Any], e: Exception, attempts: int, start: float) -> Dict[str, Any]:
+    return {"id": item.get('id'), "error_type": type(e).__name__, "error": str(e), "attempts": attempts,
+            "elapsed": round(time.monotonic() - start, 3)}
+
+
+async def _run_one(process_item: ProcessItem, make_error: MakeError, item: Dict[str, Any],
+                   policy: Optional[retry.RetryPolicy] = None) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    max_attempts = policy.max_attempts if policy is not None else 1
+    start = time.monotonic()
+    with telemetry.span("item", id=item.get('id')), transcript.scope(item.get('id')):
+        for attempt in range(1, max_attempts + 1):
+            try:
+                result = await process_item(item)
+                break
+            except Exception as e:
+                if attempt == max_attempts:
+                    stats.incr("item_errors")
+                    return make_error(item, e), _failure(item, e, attempt, start)
+                stats.incr("item_retries")
+                with telemetry.span("item_backoff"):
+                    await policy.sleep(attempt)
+    stats.incr("items_completed")
+    return result, None
+
+
+def _deliver(outcome: Tuple[Dict[str, Any], Optional[Dict[str, Any]]], on_result: OnResult,
+             on_failure: Optional[OnFailure]):
+    result, failure = outcome
+    on_result(result)
+    if failure is not None and on_failure is not None:
+        on_failure(failure)
+
+
+async def _run_async(items: Iterable[Dict[str, Any]], process_item: ProcessItem, make_error: MakeError,
+                     on_result: OnResult, concurrency: int, on_failure: Optional[OnFailure],
+                     policy: Optional[retry.RetryPolicy], groups: Optional[seed_planner.SeedPlan]):
+    semaphore = asyncio.Semaphore(concurrency)
+    pending = set()
+
+    async def run(item):
+        try:
+            outcome = await _run_one(process_item, make_error, item, policy)
+            if groups is not None:
+                groups.finish(item)
+            _deliver(outcome, on_result, on_failure)
+        finally:
+            stats.add_gauge("items_in_flight", -1)
+            semaphore.release()
+
+    for item in items:
+        await semaphore.acquire()
+        stats.add_gauge("items_in_flight", 1)
+        task = asyncio.create_task(run(item))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    if pending:
+        await asyncio.gather(*pending)
+
+
+def run_async(items: Iterable[Dict[str, Any]], process_item: ProcessItem, make_error: MakeError,
+              on_result: OnResult, concurrency: int = 256, on_failure: Optional[OnFailure] = None,
+              policy: Optional[retry.RetryPolicy] = None, groups: Optional[seed_planner.SeedPlan] = None):
+    asyncio.run(_run_async(items, process_item, make_error, on_result, concurrency, on_failure, policy, groups))
+
+
+def _report(output_queue, outcome: Any = _REPORT, exported: Any = None, block: bool = True):
+    delta, events = stats.drain(), telemetry.drain()
+    try:
+        output_queue.put((os.getpid(), outcome, exported, delta, events), block=block)
+    except queue.Full:
+        stats.merge(delta)
+        telemetry.merge(events)
+
+
+async def _run_reporting(process_item: ProcessItem, make_error: MakeError, item: Dict[str, Any],
+                         policy: Optional[retry.RetryPolicy], output_queue):
+    async def report():
+        while True:
+            await asyncio.sleep(_REPORT_INTERVAL)
+            _report(output_queue, block=False)
+
+    reporter = asyncio.create_task(report())
+    try:
+        return await _run_one(process_item, make_error, item, policy)
+    finally:
+        reporter.cancel()
+
+
+def _mp_worker(process_item: ProcessItem, make_error: MakeError, policy: Optional[retry.RetryPolicy],
+               args: Optional[argparse.Namespace], groups: Optional[seed_planner.SeedPlan], input_queue,
+               output_queue):
+    if args is not None:
+        configure_process(args)
+    startup = stats.process_age()
+    if startup is not None:
+        stats.observe("worker_startup", startup)
+    # One loop for the worker's lifetime, so keep-alive connections and seed futures outlive an item.
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            with telemetry.span("queue_wait"):
+                task = input_queue.get()
+            if task is None:
+                break
+            item, seeds = task
+            if seeds is not None:
+                groups.preload(item, seeds)
+            outcome = loop.run_until_complete(_run_reporting(process_item, make_error, item, policy, output_queue))
+            exported = None
+            if groups is not None:
+                exported = groups.export(item)
+                groups.finish(item)
+            with telemetry.span("result_put"):
+                _report(output_queue, outcome, exported)
+    finally:
+        loop.close()
+    _report(output_queue, None)
+
+
+class _GroupDispatch:
+    """Orders items so each seed group's seeds are generated once across the mp workers.
+
+    The first item of a group is dispatched on its own; the rest of the group
+    waits in the parent until that item's worker reports the seeds, and is
+    then spread over every worker with the seeds attached. If the leading
+    item produced no seeds, the next waiting item leads instead. A group the
+    plan already has seeds for, e.g. from the journal, is never held back.
+    """
+
+    def __init__(self, groups: Optional[seed_planner.SeedPlan]):
+        self.groups = groups
+        self._lock = threading.Condition()
+        self._ready = collections.deque()
+        self._waiting: Dict[str, collections.deque] = {}
+        self._seeds: Dict[str, List[str]] = {}
+
+    def tasks(self, items: Iterable[Dict[str, Any]]):
+        for item in items:
+            if self.groups is None:
+                yield item, None
+                continue
+            yield from self._drain_ready()
+            key, known = self.groups.export(item)
+            with self._lock:
+                if known is not None:
+                    self._seeds.setdefault(key, known)
+                if key in self._seeds:
+                    self._ready.append((item, self._seeds[key]))
+                elif key in self._waiting:
+                    self._waiting[key].append(item)
+                else:
+                    self._waiting[key] = collections.deque()
+                    self._ready.append((item, None))
+            yield from self._drain_ready()
+        while True:
+            with self._lock:
+                while not self._ready and self._waiting:
+                    self._lock.wait()
+                if not self._ready:
+                    return
+            yield from self._drain_ready()
+
+    def _drain_ready(self):
+        while True:
+            with self._lock:
+                if not self._ready:
+                    return
+                task = self._ready.popleft()
+            yield task
+
+    def done(self, exported: Optional[Tuple[str, Optional[List[str]]]]):
+        if exported is None:
+            return
+        key, seeds = exported
+        with self._lock:
+            waiting = self._waiting.get(key)
+            if waiting is None:
+                return
+            if seeds is not None:
+                self._seeds[key] = seeds
+                del self._waiting[key]
+                self._ready.extend((item, seeds) for item in waiting)
+            elif waiting:
+                self._ready.append((waiting.popleft(), None))
+            else:
+                del self._waiting[key]
+            self._lock.notify()
+
+
+def _feed(tasks: Iterable[Tuple[Dict[str, Any], Optional[List[str]]]], input_queue, num_workers: int):
+    for task in tasks:
+        input_queue.put(task)
+        stats.incr("items_queued")
+    for _ in range(num_workers):
+        input_queue.put(None)
+
+
+def run_multiprocess(items: Iterable[Dict[str, Any]], process_item: ProcessItem, make_error: MakeError,
+                     on_result: OnResult, num_workers: int = 64, queue_size: Optional[int] = None,
+                     on_failure: Optional[OnFailure] = None, policy: Optional[retry.RetryPolicy] = None,
+                     start_method: Optional[str] = None, args: Optional[argparse.Namespace] = None,
+                     groups: Optional[seed_planner.SeedPlan] = None):
+    context = mp.get_context(start_method)
+    worker_args = args if context.get_start_method() != "fork" else None
+    queue_size = queue_size or 2 * num_workers
+    input_queue = context.Queue(maxsize=queue_size)
+    output_queue = context.Queue(maxsize=queue_size)
+    dispatch = _GroupDispatch(groups)
+    processes = []
+
+    for _ in range(num_workers):
+        p = context.Process(target=_mp_worker,
+                            args=(process_item, make_error, policy, worker_args, groups, input_queue, output_queue))
+        p.start()
+        processes.append(p)
+
+    feeder = threading.Thread(target=_feed, args=(dispatch.tasks(items), input_queue, num_workers), daemon=True)
+    feeder.start()
+
+    finished = 0
+    while finished < num_workers:
+        pid, outcome, exported, delta, events = output_queue.get()
+        stats.merge(delta, source=pid)
+        telemetry.merge(events)
+        if outcome is None:
+            finished += 1
+        elif outcome != _REPORT:
+            dispatch.done(exported)
+            _deliver(outcome, on_result, on_failure)
+        stats.set_gauge("items_in_flight", stats.get("items_queued") - stats.get("items_completed")
+                        - stats.get("item_errors"))
+        try:
+            stats.set_gauge("input_queue_depth", input_queue.qsize())
+            stats.set_gauge("output_queue_depth", output_queue.qsize())
+        except NotImplementedError:
+            pass
+
+    feeder.join()
+    for p in processes:
+        p.join()
+
+
+def run(items: Iterable[Dict[str, Any]], process_item: ProcessItem, make_error: MakeError,
+        on_result: OnResult, args: argparse.Namespace, on_failure: Optional[OnFailure] = None,
+        groups: Optional[seed_planner.SeedPlan] = None):
+    configure(args)
+    startup = stats.process_age()
+    if startup is not None:
+        print(f"Ready to dispatch after {startup:.2f}s")
+    concurrency, workers, policy = args.concurrency, args.workers, None
+    if args.retry_failed:
+        concurrency = workers = args.retry_concurrency
+        policy = retry.RetryPolicy(max_attempts=args.retry_item_attempts, base_delay=args.retry_base_delay,
+                                   max_delay=args.retry_max_delay)
+    if args.engine == "mp":
+        run_multiprocess(items, process_item, make_error, on_result, num_workers=workers,
+                         queue_size=args.queue_size, on_failure=on_failure, policy=policy,
+                         start_method=args.start_method, args=args, groups=groups)
+    else:
+        run_async(items, process_item, make_error, on_result, concurrency=concurrency, on_failure=on_failure,
+                  policy=policy, groups=groups)
+    if startup is not None:
+        stats.set_gauge("startup_seconds", round(startup, 3))
+    if stats.summary():
+        print(f"Run stats: {stats.summary()}")
+
+
+def main(generate_comments_for_item: Callable[..., Awaitable[Dict[str, Any]]], error_record: MakeError, *,
+         default_input: str, results_path: str, api_key_env: str, seed_text: Callable[[Dict[str, Any]], str],
+         generate_seeds: Callable[[str], Awaitable[List[str]]], build_comment_messages: Callable[..., Any],
+         comment_vars: Callable[..., Dict[str, Any]], output_path: Optional[str] = None, seed_unit: str = "question",
+         option_scoring_args: bool = False, progress: bool = False):
+    """The command line of a generate_* script: parse, resume, run every remaining item and export.
+
+    results_path is where earlier runs wrote their results; output_path, when it
+    differs, is where this run exports them. option_scoring_args adds the
+    --score-mode options for scripts whose items have options.
+    """
+    parser = argparse.ArgumentParser()
+    input_reader.add_input_args(parser, default_input)
+    add_engine_args(parser)
+    joint_comments.add_comment_args(parser)
+    comment_models.add_model_args(parser)
+    compact_schema.add_output_args(parser)
+    if option_scoring_args:
+        option_scoring.add_score_args(parser)
+    parser.add_argument("--dedupe-seeds", action="store_true",
+                        help=f"generate seed personas once per distinct {seed_unit} and share them across items")
+    args = parser.parse_args()
+    if option_scoring_args:
+        option_scoring.check_args(parser, args)
+    comment_models.check_args(parser, args)
+    compact_schema.check_args(parser, args)
+
+    output_path = checkpoint.shard_output_path(output_path or results_path, args.shard)
+    checkpoint_path = checkpoint.checkpoint_path(output_path)
+    checkpoint.import_legacy(results_path, checkpoint_path, shard=args.shard)
+    processed_ids = checkpoint.scan_ids(checkpoint_path)
+    if processed_ids:
+        print(f"Loaded {len(processed_ids)} existing results to resume processing")
+    else:
+        print("Starting fresh processing")
+
+    if args.retry_failed:
+        remaining_data = input_reader.read_remaining(args, only_ids=checkpoint.scan_failed_ids(checkpoint_path))
+    else:
+        remaining_data = input_reader.read_remaining(args, skip_ids=processed_ids)
+    if remaining_data is None:
+        print("No remaining items to process")
+        exit(0)
+
+    journal = item_journal.ItemJournal(checkpoint.journal_path(checkpoint_path),
+                                       skip_ids=() if args.retry_failed else processed_ids)
+    if len(journal):
+        print(f"Resuming {len(journal)} partially processed items")
+
+    options = {"journal": journal, "models": comment_models.resolve(args.comment_models, api_key_env),
+               "comment_mode": args.comment_mode}
+    if option_scoring_args:
+        options.update(score_mode=args.score_mode, score_comments=args.score_comments,
+                       top_logprobs=args.top_logprobs)
+    process_item = functools.partial(generate_comments_for_item, **options)
+    groups = None
+    if args.dedupe_seeds:
+        remaining_data = list(remaining_data)
+        groups = seed_planner.SeedPlan(remaining_data, seed_text, generate_seeds, journal=journal)
+        print(groups.report())
+        process_item = functools.partial(process_item, seed_plan=groups)
+    if args.output_format == "compact":
+        process_item = compact_schema.compacting(process_item, build_comment_messages, comment_vars)
+
+    bar = None
+    if progress:
+        from tqdm import tqdm
+        bar = tqdm(desc="Processing remaining items")
+    with checkpoint.open_sink(checkpoint_path, args.retry_failed, verbose=True,
+                              max_bytes=args.checkpoint_max_bytes) as sink, \
+            checkpoint.DeadLetterLog(checkpoint_path) as dead_letters:
+        def on_result(result: Dict[str, Any]):
+            sink.append(result)
+            if bar is not None:
+                bar.update()
+
+        run(remaining_data, process_item, error_record, on_result, args, on_failure=dead_letters.append,
+            groups=groups)
+    if bar is not None:
+        bar.close()
+    failed_ids = checkpoint.scan_failed_ids(checkpoint_path)
+    journal.compact(failed_ids)
+    dead_letters.compact(failed_ids)
+
+    total = checkpoint.export(checkpoint_path, output_path, args.compress)
+    print(f"Processing complete. Saved {total} total results")
+    print(f"Save to {output_path}")
+    print("All processes completed")
@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+import checkpoint
+import comment_models
+
+# A bare capital only counts as an option letter when a separator follows it, so that "I think..." or
+# "A patient..." are not read as options I and A.
+_LEADING_OPTION = re.compile(r'^[\s*#>"\'(\[]*(?:(?i:option|answer)\s*:?\s*([A-Z])(?![A-Za-z])'
+                             r'|([A-Z])(?=[.):\]*]|\s+[-\u2013\u2014]|\s*(?:\n|\Z)))')
+_EPS = 1e-12
+
+
+def comment_text(comment: Any) -> str:
+    if isinstance(comment, list):
+        replies = [message.get('content', '') for message in comment
+                   if isinstance(message, dict) and message.get('role') == 'assistant']
+        return replies[-1] if replies else ''
+    return comment if isinstance(comment, str) else ''
+
+
+def leading_option(text: str, num_options: int) -> Optional[int]:
+    match = _LEADING_OPTION.match(text)
+    if match is None:
+        return None
+    index = ord(match.group(1) or match.group(2)) - ord('A')
+    return index if index < num_options else None
+
+
+def persona_weight(seed: str, weights: Dict[str, float]) -> float:
+    if not weights:
+        return 1.0
+    stakeholder = seed.rsplit(',', 1)[-1].strip().casefold()
+    return weights.get(stakeholder, weights.get('*', 1.0))
+
+
+class Batch:
+    def __init__(self):
+        self.ids: List[Any] = []
+        self.num_options: List[int] = []
+        self.gold: List[Optional[List[float]]] = []
+        self.rows: List[int] = []
+        self.cols: List[int] = []
+        self.votes: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, record: Dict[str, Any], weights: Dict[str, float]):
+        gold = record.get('gold_distribution')
+        num_options = len(record.get('options') or gold or 'ABC')
+        row = len(self.ids)
+        self.ids.append(record['id'])
+        self.num_options.append(num_options)
+        self.gold.append(gold if isinstance(gold, list) and len(gold) == num_options else None)
+        for comment in record.get('comments') or []:
+            if not isinstance(comment, dict):
+                continue
+            weight = persona_weight(comment.get('seed') or '', weights)
+            probs = comment.get('option_probs')
+            if isinstance(probs, list) and len(probs) == num_options:
+                self.rows.extend([row] * num_options)
+                self.cols.extend(range(num_options))
+                self.votes.extend(weight * p for p in probs)
+                continue
+            option = leading_option(comment_text(comment.get('comment')), num_options)
+            if option is not None:
+                self.rows.append(row)
+                self.cols.append(option)
+                self.votes.append(weight)
+
+    def evaluate(self) -> Dict[str, np.ndarray]:
+        n, width = len(self.ids), max(self.num_options)
+        counts = np.bincount(np.asarray(self.rows, dtype=np.int64) * width + np.asarray(self.cols, dtype=np.int64),
+                             weights=np.asarray(self.votes, dtype=np.float64), minlength=n * width).reshape(n, width)
+        totals = counts.sum(axis=1)
+        scored = totals > 0
+        pred = np.divide(counts, totals[:, None], out=np.zeros_like(counts), where=scored[:, None])
+
+        has_gold = np.array([g is not None for g in self.gold])
+        gold = np.zeros((n, width))
+        for row, g in enumerate(self.gold):
+            if g is not None:
+                gold[row, :len(g)] = g
+        gold_totals = gold.sum(axis=1, keepdims=True)
+        gold = np.divide(gold, gold_totals, out=np.zeros_like(gold), where=gold_totals > 0)
+
+        valid = np.arange(width)[None, :] < np.asarray(self.num_options)[:, None]
+        smoothed = np.where(valid, pred + _EPS, 0.0)
+        smoothed /= smoothed.sum(axis=1, keepdims=True)
+        mixture = 0.5 * (gold + smoothed)
+        kl = _kl_rows(gold, smoothed)
+        js = 0.5 * (_kl_rows(gold, mixture) + _kl_rows(smoothed, mixture)) / np.log(2)
+        correct = pred.argmax(axis=1) == gold.argmax(axis=1)
+        return {"pred": pred, "scored": scored, "has_gold": has_gold, "kl": kl, "js": js, "correct": correct,
+                "votes": totals}
+
+
+def _kl_rows(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    return np.where(p > 0, p * np.log(np.where(p > 0, p, 1.0) / np.where(q > 0, q, 1.0)), 0.0).sum(axis=1)
+
+
+def iter_batches(records: Iterable[Dict[str, Any]], weights: Dict[str, float], batch_size: int) -> Iterator[Batch]:
+    batch = Batch()
+    for record in records:
+        if checkpoint.is_error_record(record) or 'comments' not in record:
+            continue
+        batch.add(record, weights)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = Batch()
+    if len(batch):
+        yield batch
+
+
+def evaluate(path: str, weights: Optional[Dict[str, float]] = None, batch_size: int = 65536,
+             output_path: Optional[str] = None, model: Optional[str] = None) -> Dict[str, Any]:
+    totals = {"items": 0, "scored": 0, "with_gold": 0, "kl": 0.0, "js": 0.0, "correct": 0}
+    out = open(output_path, 'w') if output_path else None
+    try:
+        records = comment_models.selecting(checkpoint.iter_results(path), model)
+        for batch in iter_batches(records, weights or {}, batch_size):
+            result = batch.evaluate()
+            evaluated = result["scored"] & result["has_gold"]
+            totals["items"] += len(batch)
+            totals["scored"] += int(result["scored"].sum())
+            totals["with_gold"] += int(evaluated.sum())
+            totals["kl"] += float(result["kl"][evaluated].sum())
+            totals["js"] += float(result["js"][evaluated].sum())
+            totals["correct"] += int(result["correct"][evaluated].sum())
+            if out is not None:
+                for row, item_id in enumerate(batch.ids):
+                    record = {"id": item_id, "votes": float(result["votes"][row]), "pred_distribution": None}
+                    if result["scored"][row]:
+                        record["pred_distribution"] = result["pred"][row, :batch.num_options[row]].tolist()
+                    if evaluated[row]:
+                        record.update(js=float(result["js"][row]), kl=float(result["kl"][row]),
+                                      correct=bool(result["correct"][row]))
+                    out.write(json.dumps(record) + "\n")
+    finally:
+        if out is not None:
+            out.close()
+
+    evaluated = totals["with_gold"]
+    return {"items": totals["items"], "scored": totals["scored"], "evaluated": evaluated,
+            "accuracy": totals["correct"] / evaluated if evaluated else None,
+            "js_divergence": totals["js"] / evaluated if evaluated else None,
+            "kl_divergence": totals["kl"] / evaluated if evaluated else None}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate comment options into pred_distribution and score them "
+                                                 "against gold_distribution")
+    parser.add_argument("results", help="checkpoint (.jsonl) or exported results (.json)")
+    parser.add_argument("--output", default=None, help="write per-item pred_distribution and divergences as JSONL")
+    parser.add_argument("--persona-weights", default=None,
+                        help='JSON file mapping stakeholder roles to weights, e.g. {"patient": 2, "*": 1}')
+    parser.add_argument("--batch-size", type=int, default=65536)
+    parser.add_argument("--model", action="append", default=None,
+                        help="comment model to score in --comment-models results (repeatable; default: every model, "
+                             "with --output split into <output>.<model>.jsonl)")
+    args = parser.parse_args()
+
+    weights = {}
+    if args.persona_weights:
+        with open(args.persona_weights) as f:
+            weights = {role.casefold(): float(weight) for role, weight in json.load(f).items()}
+
+    models = args.model or comment_models.model_names(checkpoint.iter_results(args.results))
+    if not models:
+        print(json.dumps(evaluate(args.results, weights, args.batch_size, args.output), indent=4))
+    else:
+        root, ext = os.path.splitext(args.output) if args.output else (None, None)
+        print(json.dumps({model: evaluate(args.results, weights, args.batch_size,
+                                          f"{root}.{model.replace('/', '_')}{ext}" if root else None, model)
+                          for model in models}, indent=4))
@@ -0,0 +1,120 @@
+import argparse
+import json
+import string
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    raise ImportError("export_parquet.py needs the pyarrow package: pip install pyarrow")
+
+import checkpoint
+import comment_models
+import evaluate
+
+_DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+
+SCHEMA = pa.schema([
+    ("item_id", pa.string()),
+    ("model", _DICTIONARY),
+    ("seed_idx", pa.int16()),
+    ("seed", _DICTIONARY),
+    ("stakeholder", _DICTIONARY),
+    ("option_letter", _DICTIONARY),
+    ("option_probs", pa.list_(pa.float32())),
+    ("comment_text", pa.string()),
+    ("item_text", _DICTIONARY),
+    ("attribute", _DICTIONARY),
+    ("vrd", _DICTIONARY),
+    ("label", _DICTIONARY),
+])
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+class Columns:
+    def __init__(self):
+        self.columns: Dict[str, List[Any]] = {field.name: [] for field in SCHEMA}
+        self.items = 0
+        self.errors = 0
+
+    def __len__(self) -> int:
+        return len(self.columns["item_id"])
+
+    def add(self, record: Dict[str, Any]):
+        if checkpoint.is_error_record(record):
+            self.errors += 1
+            return
+        self.items += 1
+        options = record.get('options')
+        letters = string.ascii_uppercase[:len(options)] if options else ""
+        item = {
+            "item_id": str(record.get('id')),
+            "item_text": record.get('question') or record.get('situation') or record.get('input'),
+            "attribute": _text(record.get('attribute')),
+            "vrd": _text(record.get('vrd')),
+            "label": _text(record.get('label_text', record.get('label'))),
+        }
+        for model, view in comment_models.views(record):
+            for seed_idx, comment in enumerate(view.get('comments') or []):
+                if not isinstance(comment, dict):
+                    continue
+                seed = comment.get('seed') or ''
+                text = evaluate.comment_text(comment.get('comment')) or None
+                option = evaluate.leading_option(text, len(letters)) if text and letters else None
+                row = dict(item, model=model, seed_idx=seed_idx, seed=seed, comment_text=text,
+                           stakeholder=seed.rsplit(',', 1)[-1].strip() if ',' in seed else None,
+                           option_letter=letters[option] if option is not None else None,
+                           option_probs=comment.get('option_probs'))
+                for name, values in self.columns.items():
+                    values.append(row[name])
+
+    def to_batch(self) -> pa.RecordBatch:
+        arrays = []
+        for field in SCHEMA:
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(self.columns[field.name], type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(self.columns[field.name], type=field.type))
+        for values in self.columns.values():
+            values.clear()
+        return pa.RecordBatch.from_arrays(arrays, schema=SCHEMA)
+
+
+def iter_batches(path: str, batch_rows: int = 65536, columns: Optional[Columns] = None) -> Iterator[pa.RecordBatch]:
+    columns = columns if columns is not None else Columns()
+    for record in checkpoint.iter_results(path):
+        columns.add(record)
+        if len(columns) >= batch_rows:
+            yield columns.to_batch()
+    if len(columns):
+        yield columns.to_batch()
+
+
+def export_parquet(path: str, output_path: str, batch_rows: int = 65536, compression: str = "zstd") -> Dict[str, int]:
+    columns = Columns()
+    rows = 0
+    dictionary_columns = [field.name for field in SCHEMA if pa.types.is_dictionary(field.type)]
+    with pq.ParquetWriter(output_path, SCHEMA, compression=compression, use_dictionary=dictionary_columns) as writer:
+        for batch in iter_batches(path, batch_rows, columns):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return {"items": columns.items, "errors": columns.errors, "rows": rows}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Flatten results into one row per comment and write them as Parquet")
+    parser.add_argument("results", help="checkpoint (.jsonl), zstd container (.jsonl.zst) or exported results (.json)")
+    parser.add_argument("output", help="Parquet file to write")
+    parser.add_argument("--batch-rows", type=int, default=65536, help="rows per record batch and row group")
+    parser.add_argument("--compression", default="zstd", help="Parquet codec (zstd, snappy, gzip, none)")
+    args = parser.parse_args()
+
+    counts = export_parquet(args.results, args.output, args.batch_rows, args.compression)
+    print(f"Wrote {counts['rows']} comment rows from {counts['items']} items "
+          f"({counts['errors']} error records skipped) to {args.output}")
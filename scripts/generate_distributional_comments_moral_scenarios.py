@@ -1,17 +1,24 @@
-import torch.multiprocessing as mp
-import json
+import asyncio
+import functools
 import re
 from typing import List
-from tqdm import tqdm
-from oai_client import OpenAIClient
-import os
 from dotenv import load_dotenv
 
+import comment_models
+import engine
+import item_journal
+import joint_comments
+import llm
+import option_scoring
+import seed_planner
+import telemetry
+
 load_dotenv()
 
-def generate_seed_personalities(question: str, num_groups=6) -> List[str]:
-    client = OpenAIClient(model="deepseek-reasoner", api_key=os.getenv("DEEPSEEK_API_KEY"))
+COMMENT_MODEL = "Qwen2.5-7B"
+COMMENT_API_KEY_ENV = "QWEN_API_KEY"
 
+async def request_seed_personalities(question: str, num_groups: int, existing: List[str]) -> List[str]:
     prompt = f"""
 Generate {num_groups} contrasting ethical perspectives on: "{question}"
 
@@ -25,8 +32,11 @@ Each perspective must differ clearly in:
 FORMAT EACH PERSPECTIVE EXACTLY LIKE THIS (start each with # symbol):
 #Name: Core Value, Ethical Framework, Right/Duty, Emotion, Stakeholder
     """
+    if existing:
+        prompt += "\nEach new perspective must also differ clearly from these existing ones:\n"
+        prompt += "\n".join(f"#{group}" for group in existing) + "\n"
 
-    response = client.call_oai([
+    response = await llm.call_llm("deepseek-reasoner", "DEEPSEEK_API_KEY", [
         {"role": "system", "content": "Generate diverse ethical perspectives concisely using the exact requested format."},
         {"role": "user", "content": prompt}
     ], max_new_tokens=500, temperature=1)
@@ -37,15 +47,12 @@ FORMAT EACH PERSPECTIVE EXACTLY LIKE THIS (start each with # symbol):
 
     groups = [line.split('#', 1)[1].strip() for line in response.strip().split('\n') if line.startswith('#')]
 
-    if len(groups) < num_groups:
-        print(f"Warning: Generated {len(groups)} groups, retrying.")
-        return generate_seed_personalities(question, num_groups)
-
     return groups
 
-def generate_detailed_comment(input: str, personality: str, attribute: str = None) -> List[dict[str, str]]:
-    client = OpenAIClient(model="Qwen2.5-7B", api_key=os.getenv("QWEN_API_KEY"))
+async def generate_seed_personalities(question: str, num_groups=6) -> List[str]:
+    return await seed_planner.collect_seed_groups(functools.partial(request_seed_personalities, question), num_groups)
 
+def build_comment_messages(input: str, personality: str, attribute: str = None) -> List[dict[str, str]]:
     base_prompt = f"""
 Input: "{input}"
 Perspective: {personality}
@@ -62,122 +69,96 @@ Begin immediately without introduction.
 
     prompt = f"You are from the country of {attribute}, respond to the following instruction with explanation. {base_prompt}" if attribute else base_prompt
 
-    messages = [
+    return [
         {"role": "system", "content": "Directly analyze moral values, rights, and duties clearly and concisely from given perspective."},
         {"role": "user", "content": prompt}
     ]
 
-    response = client.call_oai(messages, max_new_tokens=200, temperature=1)
+async def generate_detailed_comment(input: str, personality: str, attribute: str = None, model: str = COMMENT_MODEL,
+                                    api_key_env: str = COMMENT_API_KEY_ENV) -> List[dict[str, str]]:
+    messages = build_comment_messages(input, personality, attribute=attribute)
+    response = await llm.call_llm(model, api_key_env, messages, max_new_tokens=200, temperature=1)
     response = re.sub(r'^(As a|From the perspective|Speaking as).*?[:;]', '', response, flags=re.I).strip()
 
     messages.append({"role": "assistant", "content": response})
     return messages
 
-def generate_comments_for_item(item):
-    seeds = generate_seed_personalities(item['question'])
-    comments = []
-
-    for seed in seeds:
-        comment = generate_detailed_comment(
-            input=item['question'],
-            personality=seed,
-            attribute=item.get('attribute', None)
-        )
-        comments.append({"seed": seed, "comment": comment})
-
+def seed_text(item):
+    return item['question']
+
+def comment_vars(item):
+    return {"input": item['question'], "attribute": item.get('attribute', None)}
+
+async def generate_model_comments(item, seeds, model, api_key_env, journal, comment_mode="per-seed",
+                                  score_mode="generate", score_comments=False, top_logprobs=20):
+    comments = [{"seed": seed} for seed in seeds]
+    pred_distribution = item.get('pred_distribution', None)
+
+    if score_mode == "logprobs":
+        with telemetry.span("scores", count=len(seeds), model=model):
+            option_probs = await option_scoring.score_seeds(
+                functools.partial(build_comment_messages, item['question'], attribute=item.get('attribute', None)),
+                seeds, option_scoring.option_letters(item.get('options')), model, api_key_env, top_logprobs
+            )
+        for comment, probs in zip(comments, option_probs):
+            comment["option_probs"] = probs
+        pred_distribution = option_scoring.aggregate(option_probs)
+
+    if score_mode == "generate" or score_comments:
+        with telemetry.span("comments", count=len(seeds), mode=comment_mode, model=model):
+            if comment_mode == "joint":
+                comment_messages = await journal.comments(item['id'], seeds, functools.partial(
+                    joint_comments.generate_joint_comments,
+                    functools.partial(build_comment_messages, item['question'], attribute=item.get('attribute', None)),
+                    functools.partial(generate_detailed_comment, item['question'], attribute=item.get('attribute', None),
+                                      model=model, api_key_env=api_key_env),
+                    model=model, api_key_env=api_key_env
+                ))
+            else:
+                comment_messages = await asyncio.gather(*(
+                    journal.comment(item['id'], index, functools.partial(
+                        generate_detailed_comment,
+                        input=item['question'],
+                        personality=seed,
+                        attribute=item.get('attribute', None),
+                        model=model,
+                        api_key_env=api_key_env
+                    ))
+                    for index, seed in enumerate(seeds)
+                ))
+        for comment, messages in zip(comments, comment_messages):
+            comment["comment"] = messages
+    return {"pred_distribution": pred_distribution, "comments": comments}
+
+async def generate_comments_for_item(item, seed_plan=None, journal=item_journal.DISABLED, models=None,
+                                     comment_mode="per-seed", score_mode="generate", score_comments=False,
+                                     top_logprobs=20):
+    with telemetry.span("seeds"):
+        seeds = await journal.seeds(item['id'], functools.partial(
+            seed_plan.seeds if seed_plan else generate_seed_personalities, seed_text(item)
+        ))
+    outputs = await comment_models.fan_out(models, (COMMENT_MODEL, COMMENT_API_KEY_ENV), journal,
+                                           functools.partial(generate_model_comments, item, seeds,
+                                                             comment_mode=comment_mode, score_mode=score_mode,
+                                                             score_comments=score_comments, top_logprobs=top_logprobs))
+
+    journal.finish(item['id'])
     return {
         "id": item['id'],
         "question": item['question'],
         "options": item.get('options', None),
         "attribute": item.get('attribute', None),
         "gold_distribution": item.get('gold_distribution', None),
-        "pred_distribution": item.get('pred_distribution', None),
-        "comments": comments,
+        **outputs,
     }
 
-def worker(input_queue, output_queue):
-    while True:
-        item = input_queue.get()
-        if item is None:
-            break
-        try:
-            result = generate_comments_for_item(item)
-            output_queue.put(result)
-        except Exception as e:
-            print(f"Error processing item {item['id']}: {e}")
-            output_queue.put({"id": item['id'], "question": item['question'], "comments": ["Error occurred"], "seed_groups": []})
+def error_record(item, e):
+    print(f"Error processing item {item['id']}: {e}")
+    return {"id": item['id'], "question": item['question'], "comments": ["Error occurred"], "seed_groups": []}
 
 if __name__ == "__main__":
-    input_path = 'input/vital_distributional_moral_scenarios.json'
-    output_path = 'comments/distributional_moral_scenarios.json'
-
-    with open(input_path, 'r') as f:
-        data = json.load(f)
-
-    try:
-        with open(output_path, 'r') as f:
-            existing_results = json.load(f)
-            processed_ids = {result['id'] for result in existing_results}
-            print(f"Loaded {len(existing_results)} existing results to resume processing")
-    except (FileNotFoundError, json.JSONDecodeError):
-        existing_results = []
-        processed_ids = set()
-        print("Starting fresh processing")
-
-    remaining_data = [item for item in data if item['id'] not in processed_ids]
-    print(f"Processing {len(remaining_data)} remaining items out of {len(data)} total")
-
-    if not remaining_data:
-        print("No remaining items to process")
-        exit(0)
-
-    input_queue = mp.Queue()
-    output_queue = mp.Queue()
-    processes = []
-    num_workers = 64
-
-    def saver_process(output_queue, save_every=10):
-        results = existing_results.copy()
-        completed = 0
-        try:
-            while True:
-                result = output_queue.get()
-                if result is None:
-                    break
-                results.append(result)
-                completed += 1
-                if completed % save_every == 0:
-                    with open(output_path, 'w') as f:
-                        json.dump(results, f, indent=4)
-                    print(f"Saved progress: {len(results)} items ({completed} new)")
-            with open(output_path, 'w') as f:
-                json.dump(results, f, indent=4)
-            print(f"Processing complete. Saved {len(results)} total results")
-        except Exception as e:
-            with open(output_path, 'w') as f:
-                json.dump(results, f, indent=4)
-            print(f"Error in saver process: {e}")
-            print(f"Emergency save completed with {len(results)} results")
-
-    for _ in range(num_workers):
-        p = mp.Process(target=worker, args=(input_queue, output_queue))
-        p.start()
-        processes.append(p)
-
-    saver = mp.Process(target=saver_process, args=(output_queue,))
-    saver.start()
-
-    for item in remaining_data:
-        input_queue.put(item)
-
-    for _ in range(num_workers):
-        input_queue.put(None)
-
-    for p in processes:
-        p.join()
-
-    output_queue.put(None)
-    saver.join()
-
-    print(f"Save to {output_path}")
-    print("All processes completed")
+    engine.main(generate_comments_for_item, error_record, default_input='input/vital_distributional_moral_scenarios.json',
+                results_path='comments/distributional_moral_scenarios.json', api_key_env=COMMENT_API_KEY_ENV,
+                seed_text=seed_text, generate_seeds=generate_seed_personalities,
+                build_comment_messages=build_comment_messages, comment_vars=comment_vars,
+                option_scoring_args=True)
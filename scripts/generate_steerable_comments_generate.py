@@ -1,17 +1,23 @@
-import torch.multiprocessing as mp
-import json
+import asyncio
+import functools
 import re
 from typing import List
-from tqdm import tqdm
-from oai_client import OpenAIClient
-import os
 from dotenv import load_dotenv
 
+import comment_models
+import engine
+import item_journal
+import joint_comments
+import llm
+import seed_planner
+import telemetry
+
 load_dotenv()
 
-def generate_seed_personalities(situation: str, num_groups=6) -> List[str]:
-    client = OpenAIClient(model="deepseek-reasoner", api_key=os.getenv("DEEPSEEK_API_KEY"))
+COMMENT_MODEL = "Qwen2.5-7B"
+COMMENT_API_KEY_ENV = "qwen_api_key"
 
+async def request_seed_personalities(situation: str, num_groups: int, existing: List[str]) -> List[str]:
     prompt = f"""
 Generate {num_groups} contrasting ethical perspectives on: "{situation}
 
@@ -25,22 +31,23 @@ Each perspective must differ clearly in:
 FORMAT EACH PERSPECTIVE EXACTLY LIKE THIS (start each with # symbol):
 #Name: Core Value, Ethical Framework, Right/Duty, Emotion, Stakeholder
     """
+    if existing:
+        prompt += "\nEach new perspective must also differ clearly from these existing ones:\n"
+        prompt += "\n".join(f"#{group}" for group in existing) + "\n"
 
-    response = client.call_oai([
+    response = await llm.call_llm("deepseek-reasoner", "DEEPSEEK_API_KEY", [
         {"role": "system", "content": "Generate diverse ethical perspectives concisely using the exact requested format."},
         {"role": "user", "content": prompt}
     ], max_new_tokens=450, temperature=1)
 
     groups = [line.split('#', 1)[1].strip() for line in response.strip().split('\n') if line.startswith('#')]
 
-    if len(groups) < num_groups:
-        return generate_seed_personalities(situation, num_groups)
-
     return groups
 
-def generate_detailed_comment(input_text: str, personality: str) -> List[dict[str, str]]:
-    client = OpenAIClient(model="Qwen2.5-7B", api_key=os.getenv("qwen_api_key"))
+async def generate_seed_personalities(situation: str, num_groups=6) -> List[str]:
+    return await seed_planner.collect_seed_groups(functools.partial(request_seed_personalities, situation), num_groups)
 
+def build_comment_messages(input_text: str, personality: str) -> List[dict[str, str]]:
     prompt = f"""
 Input: "{input_text}"
 Perspective: {personality}
@@ -55,25 +62,54 @@ Explicitly start your answer with the chosen option (A, B, or C) clearly indicat
 Begin immediately without introduction.
 """
 
-    messages = [
+    return [
         {"role": "system", "content": "Directly analyze moral values, rights, and duties clearly and concisely from given perspective."},
         {"role": "user", "content": prompt}
     ]
 
-    response = client.call_oai(messages, max_new_tokens=200, temperature=1)
+async def generate_detailed_comment(input_text: str, personality: str, model: str = COMMENT_MODEL,
+                                    api_key_env: str = COMMENT_API_KEY_ENV) -> List[dict[str, str]]:
+    messages = build_comment_messages(input_text, personality)
+    response = await llm.call_llm(model, api_key_env, messages, max_new_tokens=200, temperature=1)
     response = re.sub(r'^(As a|From the perspective|Speaking as).*?[:;]', '', response, flags=re.I).strip()
 
     messages.append({"role": "assistant", "content": response})
     return messages
 
-def generate_comments_for_item(item):
-    seeds = generate_seed_personalities(item['situation'])
-    comments = []
-
-    for seed in seeds:
-        comment = generate_detailed_comment(item['input'], seed)
-        comments.append({"seed": seed, "comment": comment})
-
+def seed_text(item):
+    return item['situation']
+
+def comment_vars(item):
+    return {"input_text": item['input']}
+
+async def generate_model_comments(item, seeds, model, api_key_env, journal, comment_mode="per-seed"):
+    with telemetry.span("comments", count=len(seeds), mode=comment_mode, model=model):
+        if comment_mode == "joint":
+            comment_messages = await journal.comments(item['id'], seeds, functools.partial(
+                joint_comments.generate_joint_comments,
+                functools.partial(build_comment_messages, item['input']),
+                functools.partial(generate_detailed_comment, item['input'], model=model, api_key_env=api_key_env),
+                model=model, api_key_env=api_key_env
+            ))
+        else:
+            comment_messages = await asyncio.gather(*(
+                journal.comment(item['id'], index, functools.partial(generate_detailed_comment, item['input'], seed,
+                                                                     model=model, api_key_env=api_key_env))
+                for index, seed in enumerate(seeds)
+            ))
+    return {"comments": [{"seed": seed, "comment": comment} for seed, comment in zip(seeds, comment_messages)]}
+
+async def generate_comments_for_item(item, seed_plan=None, journal=item_journal.DISABLED, models=None,
+                                     comment_mode="per-seed"):
+    with telemetry.span("seeds"):
+        seeds = await journal.seeds(item['id'], functools.partial(
+            seed_plan.seeds if seed_plan else generate_seed_personalities, seed_text(item)
+        ))
+    outputs = await comment_models.fan_out(models, (COMMENT_MODEL, COMMENT_API_KEY_ENV), journal,
+                                           functools.partial(generate_model_comments, item, seeds,
+                                                             comment_mode=comment_mode))
+
+    journal.finish(item['id'])
     return {
         "id": item['id'],
         "situation": item['situation'],
@@ -81,82 +117,15 @@ def generate_comments_for_item(item):
         "label_text": item.get('label_text', None),
         "label": item.get('label', None),
         "input": item.get('input', None),
-        "comments": comments,
+        **outputs,
     }
 
-def worker(input_queue, output_queue):
-    while True:
-        item = input_queue.get()
-        if item is None:
-            break
-        try:
-            result = generate_comments_for_item(item)
-            output_queue.put(result)
-        except Exception as e:
-            output_queue.put({"id": item['id'], "vrd": item.get('vrd'), "explanation": item.get('explanation'), "comments": ["Error occurred"], "seed_groups": []})
+def error_record(item, e):
+    return {"id": item['id'], "vrd": item.get('vrd'), "explanation": item.get('explanation'), "comments": ["Error occurred"], "seed_groups": []}
 
 if __name__ == "__main__":
-    with open('input/vital_steerable_valuekaleidoscope.json', 'r') as f:
-        data = json.load(f)
-
-    output_path = 'comments/vital_steerable_comments_deepseek_chat.json'
-
-    try:
-        with open(output_path, 'r') as f:
-            existing_results = json.load(f)
-            processed_ids = {result['id'] for result in existing_results}
-    except (FileNotFoundError, json.JSONDecodeError):
-        existing_results = []
-        processed_ids = set()
-
-    remaining_data = [item for item in data if item['id'] not in processed_ids]
-
-    if not remaining_data:
-        exit(0)
-
-    input_queue = mp.Queue()
-    output_queue = mp.Queue()
-    processes = []
-    num_workers = 64
-
-    def saver_process(output_queue, save_every=10):
-        results = existing_results.copy()
-        completed = 0
-        try:
-            while True:
-                result = output_queue.get()
-                if result is None:
-                    break
-                results.append(result)
-                completed += 1
-                if completed % save_every == 0:
-                    with open(output_path, 'w') as f:
-                        json.dump(results, f, indent=4)
-            with open(output_path, 'w') as f:
-                json.dump(results, f, indent=4)
-        except Exception as e:
-            with open(output_path, 'w') as f:
-                json.dump(results, f, indent=4)
-
-    for _ in range(num_workers):
-        p = mp.Process(target=worker, args=(input_queue, output_queue))
-        p.start()
-        processes.append(p)
-
-    saver = mp.Process(target=saver_process, args=(output_queue,))
-    saver.start()
-
-    for item in remaining_data:
-        input_queue.put(item)
-
-    for _ in range(num_workers):
-        input_queue.put(None)
-
-    for p in processes:
-        p.join()
-
-    output_queue.put(None)
-    saver.join()
-
-    print(f"Saved to {output_path}")
-    print("All processes completed")
+    engine.main(generate_comments_for_item, error_record, default_input='input/vital_steerable_valuekaleidoscope.json',
+                results_path='comments/vital_steerable_comments_deepseek_chat.json', api_key_env=COMMENT_API_KEY_ENV,
+                seed_text=seed_text, generate_seeds=generate_seed_personalities,
+                build_comment_messages=build_comment_messages, comment_vars=comment_vars,
+                seed_unit="situation")
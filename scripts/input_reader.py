@@ -0,0 +1,151 @@
+import argparse
+import hashlib
+import itertools
+import json
+from typing import Any, Container, Dict, Iterator, Optional, TextIO, Tuple
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+def add_input_args(parser: argparse.ArgumentParser, default_input: str):
+    parser.add_argument("--input", default=default_input, help="JSON array or JSONL file of items")
+    parser.add_argument("--offset", type=int, default=0, help="skip this many input items")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many input items")
+    parser.add_argument("--id-range", default=None, metavar="LO:HI",
+                        help="only items with LO <= id < HI (either bound may be omitted)")
+    parser.add_argument("--sample", type=float, default=None,
+                        help="deterministic fraction of items to keep, chosen by a hash of the id")
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="i/N",
+                        help="only process shard i of N, chosen by a stable hash of the id")
+
+
+def stable_hash(item_id: Any) -> int:
+    return int(hashlib.md5(str(item_id).encode("utf-8")).hexdigest()[:16], 16)
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    index, _, count = value.partition("/")
+    try:
+        shard = int(index), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if not 0 <= shard[0] < shard[1]:
+        raise argparse.ArgumentTypeError(f"shard index must be in [0, {shard[1]}), got {value!r}")
+    return shard
+
+
+def in_shard(item_id: Any, shard: Optional[Tuple[int, int]]) -> bool:
+    return shard is None or stable_hash(item_id) % shard[1] == shard[0]
+
+
+def _read_more(f: TextIO, buf: str, pos: int, chunk_size: int):
+    chunk = f.read(chunk_size)
+    return buf[pos:] + chunk, 0, not chunk
+
+
+def _iter_json_array(f: TextIO, chunk_size: int) -> Iterator[Any]:
+    buf, pos, eof = "", 0, False
+    expect_open = True
+    while True:
+        while pos < len(buf) and (buf[pos] in _WHITESPACE or (buf[pos] == "," and not expect_open)):
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                raise ValueError("unexpected end of JSON array")
+            buf, pos, eof = _read_more(f, buf, pos, chunk_size)
+            continue
+        if expect_open:
+            if buf[pos] != "[":
+                raise ValueError("expected a JSON array")
+            pos += 1
+            expect_open = False
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            value, end = _decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            buf, pos, eof = _read_more(f, buf, pos, chunk_size)
+            continue
+        if end == len(buf) and not eof:
+            buf, pos, eof = _read_more(f, buf, pos, chunk_size)
+            continue
+        yield value
+        pos = end
+        if pos > chunk_size:
+            buf, pos = buf[pos:], 0
+
+
+def _iter_jsonl(f: TextIO) -> Iterator[Any]:
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_items(path: str, chunk_size: int = 1 << 16) -> Iterator[Dict[str, Any]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        head = f.read(1)
+        while head and head in _WHITESPACE:
+            head = f.read(1)
+        f.seek(0)
+        if head == "[":
+            yield from _iter_json_array(f, chunk_size)
+        else:
+            yield from _iter_jsonl(f)
+
+
+def _bound(value: str):
+    if value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _in_range(item_id: Any, lo: Any, hi: Any) -> bool:
+    if isinstance(lo, int) or isinstance(hi, int):
+        try:
+            item_id = int(item_id)
+        except (TypeError, ValueError):
+            return False
+    else:
+        item_id = str(item_id)
+    return (lo is None or item_id >= lo) and (hi is None or item_id < hi)
+
+
+def read_items(path: str, skip_ids: Container[Any] = (), offset: int = 0, limit: Optional[int] = None,
+               id_range: Optional[str] = None, sample: Optional[float] = None,
+               shard: Optional[Tuple[int, int]] = None,
+               only_ids: Optional[Container[Any]] = None) -> Iterator[Dict[str, Any]]:
+    items = iter_items(path)
+    if offset or limit is not None:
+        items = itertools.islice(items, offset, None if limit is None else offset + limit)
+    lo, hi = (_bound(part) for part in id_range.split(":", 1)) if id_range else (None, None)
+    threshold = int(sample * 2 ** 64) if sample is not None else None
+    for item in items:
+        item_id = item['id']
+        if item_id in skip_ids:
+            continue
+        if only_ids is not None and item_id not in only_ids:
+            continue
+        if id_range and not _in_range(item_id, lo, hi):
+            continue
+        if threshold is not None and stable_hash(item_id) >= threshold:
+            continue
+        if not in_shard(item_id, shard):
+            continue
+        yield item
+
+
+def read_remaining(args: argparse.Namespace, skip_ids: Container[Any] = (),
+                   only_ids: Optional[Container[Any]] = None) -> Optional[Iterator[Dict[str, Any]]]:
+    items = read_items(args.input, skip_ids=skip_ids, offset=args.offset, limit=args.limit,
+                       id_range=args.id_range, sample=args.sample, shard=args.shard, only_ids=only_ids)
+    first = next(items, None)
+    if first is None:
+        return None
+    return itertools.chain([first], items)
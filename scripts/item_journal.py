@@ -0,0 +1,142 @@
+import json
+import os
+from typing import Any, Awaitable, Callable, Container, Dict, List, Optional, Set, Tuple
+
+import checkpoint
+import stats
+import telemetry
+
+Messages = List[Dict[str, str]]
+CommentKey = Tuple[Optional[str], int]
+
+
+class ItemJournal:
+    """Records each item's seeds and every finished comment as soon as they arrive.
+
+    A resumed or retried item reuses what was recorded and only issues the
+    missing calls. Comments from a --comment-models run also record their
+    model. Entries of an item are dropped from memory once it finishes;
+    compact() rewrites the file down to the items that never did.
+    """
+
+    def __init__(self, path: Optional[str], skip_ids: Container[Any] = ()):
+        self.path = path
+        self._seeds: Dict[Any, List[str]] = {}
+        self._comments: Dict[Any, Dict[CommentKey, Messages]] = {}
+        self._fd = None
+        for entry in checkpoint.iter_records(path) if path else ():
+            if entry.get('id') in skip_ids:
+                continue
+            if "seeds" in entry:
+                self._seeds[entry['id']] = entry['seeds']
+                self._comments.pop(entry['id'], None)
+            elif "comment" in entry:
+                key = (entry.get('model'), entry['index'])
+                self._comments.setdefault(entry['id'], {})[key] = entry['comment']
+
+    def __len__(self) -> int:
+        return len(self._seeds)
+
+    def _append(self, entry: Dict[str, Any]):
+        if self.path is None:
+            return
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        with telemetry.span("journal_append"):
+            data = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+            os.write(self._fd, data)
+        stats.incr("journal_bytes", len(data))
+
+    def recorded_seeds(self, item_id: Any) -> Optional[List[str]]:
+        return self._seeds.get(item_id)
+
+    async def seeds(self, item_id: Any, generate: Callable[[], Awaitable[List[str]]]) -> List[str]:
+        if item_id in self._seeds:
+            stats.incr("journal_seeds_reused")
+            return self._seeds[item_id]
+        seeds = await generate()
+        self._seeds[item_id] = seeds
+        self._comments.pop(item_id, None)
+        self._append({"id": item_id, "seeds": seeds})
+        return seeds
+
+    def _record(self, item_id: Any, index: int, messages: Messages, model: Optional[str]):
+        self._comments.setdefault(item_id, {})[(model, index)] = messages
+        entry = {"id": item_id, "index": index, "comment": messages}
+        if model is not None:
+            entry["model"] = model
+        self._append(entry)
+
+    async def comment(self, item_id: Any, index: int, generate: Callable[[], Awaitable[Messages]],
+                      model: Optional[str] = None) -> Messages:
+        done = self._comments.get(item_id, {})
+        if (model, index) in done:
+            stats.incr("journal_comments_reused")
+            return done[(model, index)]
+        messages = await generate()
+        self._record(item_id, index, messages, model)
+        return messages
+
+    async def comments(self, item_id: Any, seeds: List[str],
+                       generate: Callable[[List[str]], Awaitable[List[Messages]]],
+                       model: Optional[str] = None) -> List[Messages]:
+        done = self._comments.get(item_id, {})
+        missing = [i for i in range(len(seeds)) if (model, i) not in done]
+        stats.incr("journal_comments_reused", len(seeds) - len(missing))
+        if missing:
+            for index, messages in zip(missing, await generate([seeds[i] for i in missing])):
+                self._record(item_id, index, messages, model)
+        done = self._comments.get(item_id, {})
+        return [done[(model, i)] for i in range(len(seeds))]
+
+    def for_model(self, model: str) -> "ModelJournal":
+        return ModelJournal(self, model)
+
+    def finish(self, item_id: Any):
+        self._seeds.pop(item_id, None)
+        self._comments.pop(item_id, None)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def compact(self, keep_ids: Set[Any]):
+        self.close()
+        if self.path is None or not os.path.exists(self.path):
+            return
+        kept = [line for _, _, line in checkpoint.iter_line_offsets(self.path) if _entry_id(line) in keep_ids]
+        if kept:
+            checkpoint.rewrite(self.path, kept)
+        else:
+            os.remove(self.path)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_fd'] = None
+        return state
+
+
+class ModelJournal:
+    """The comment calls of one ItemJournal, keyed by a comment model."""
+
+    def __init__(self, journal: ItemJournal, model: str):
+        self.journal = journal
+        self.model = model
+
+    async def comment(self, item_id: Any, index: int, generate: Callable[[], Awaitable[Messages]]) -> Messages:
+        return await self.journal.comment(item_id, index, generate, model=self.model)
+
+    async def comments(self, item_id: Any, seeds: List[str],
+                       generate: Callable[[List[str]], Awaitable[List[Messages]]]) -> List[Messages]:
+        return await self.journal.comments(item_id, seeds, generate, model=self.model)
+
+
+def _entry_id(line: bytes):
+    try:
+        return json.loads(line).get('id')
+    except (json.JSONDecodeError, AttributeError):
+        return None
+
+
+DISABLED = ItemJournal(None)
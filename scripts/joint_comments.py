@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import json
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import llm
+import stats
+
+BuildMessages = Callable[[str], List[Dict[str, str]]]
+GenerateComment = Callable[[str], Awaitable[List[Dict[str, str]]]]
+
+_CODE_FENCE = re.compile(r'^```(?:json)?\s*|\s*```$')
+
+JOINT_INSTRUCTIONS = """
+Write one separate comment for each numbered perspective above, following the instructions from that perspective alone.
+Respond with JSON only, exactly {num_seeds} entries in perspective order:
+{{"comments": [{{"perspective": 1, "comment": "..."}}, {{"perspective": 2, "comment": "..."}}]}}
+"""
+
+
+def add_comment_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--comment-mode", choices=["per-seed", "joint"], default="per-seed",
+                        help="per-seed: one comment request per seed persona; joint: one structured request per item "
+                             "covering every persona, re-requesting only the ones that fail validation")
+
+
+def response_format(num_seeds: int) -> Dict[str, Any]:
+    entry = {"type": "object", "properties": {"perspective": {"type": "integer"}, "comment": {"type": "string"}},
+             "required": ["perspective", "comment"], "additionalProperties": False}
+    schema = {"type": "object", "required": ["comments"], "additionalProperties": False,
+              "properties": {"comments": {"type": "array", "items": entry, "minItems": num_seeds, "maxItems": num_seeds}}}
+    return {"type": "json_schema", "json_schema": {"name": "perspective_comments", "strict": True, "schema": schema}}
+
+
+def joint_messages(build_messages: BuildMessages, seeds: List[str]) -> List[Dict[str, str]]:
+    perspectives = "\n" + "\n".join(f"{i}. {seed}" for i, seed in enumerate(seeds, 1))
+    messages = build_messages(perspectives)
+    messages[-1] = dict(messages[-1], content=messages[-1]["content"] + JOINT_INSTRUCTIONS.format(num_seeds=len(seeds)))
+    return messages
+
+
+def parse_joint_response(response: str, num_seeds: int, min_words: int = 20) -> List[Optional[str]]:
+    comments: List[Optional[str]] = [None] * num_seeds
+    try:
+        payload = json.loads(_CODE_FENCE.sub('', response.strip()))
+    except json.JSONDecodeError:
+        stats.incr("joint_parse_failures")
+        return comments
+    entries = payload.get("comments") if isinstance(payload, dict) else payload
+    if not isinstance(entries, list):
+        stats.incr("joint_parse_failures")
+        return comments
+    for position, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            continue
+        index, comment = entry.get("perspective", position + 1), entry.get("comment")
+        if not isinstance(index, int) or not 1 <= index <= num_seeds or not isinstance(comment, str):
+            continue
+        comment = re.sub(r'^(As a|From the perspective|Speaking as).*?[:;]', '', comment.strip(), flags=re.I).strip()
+        if len(comment.split()) >= min_words and comments[index - 1] is None:
+            comments[index - 1] = comment
+    return comments
+
+
+async def generate_joint_comments(build_messages: BuildMessages, generate_comment: GenerateComment, seeds: List[str],
+                                  model: str, api_key_env: str, max_new_tokens: int = 200,
+                                  temperature: float = 1) -> List[List[Dict[str, str]]]:
+    response = await llm.call_llm(model, api_key_env, joint_messages(build_messages, seeds),
+                                  max_new_tokens=max_new_tokens * len(seeds) + 50, temperature=temperature,
+                                  response_format=response_format(len(seeds)))
+    stats.incr("joint_requests")
+    comments = parse_joint_response(response, len(seeds))
+
+    missing = [i for i, comment in enumerate(comments) if comment is None]
+    if missing:
+        stats.incr("joint_rerequests", len(missing))
+    rerequested = dict(zip(missing, await asyncio.gather(*(generate_comment(seeds[i]) for i in missing))))
+
+    results = []
+    for i, seed in enumerate(seeds):
+        if i in rerequested:
+            results.append(rerequested[i])
+            continue
+        messages = build_messages(seed)
+        messages.append({"role": "assistant", "content": comments[i]})
+        results.append(messages)
+    return results
@@ -0,0 +1,222 @@
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import rate_limit
+from openai_compat import ChatClient
+import retry
+import stats
+import telemetry
+from response_cache import ResponseCache
+from transcript import TranscriptRecorder, TranscriptReplay
+
+_executor: Optional[ThreadPoolExecutor] = None
+_request_threads = 64
+
+_clients: Dict[Tuple[str, str], Any] = {}
+_base_url: Optional[str] = None
+_clients_lock = threading.Lock()
+
+_cache_config: Optional[Dict[str, Any]] = None
+_cache: Optional[ResponseCache] = None
+
+_recorder: Optional[TranscriptRecorder] = None
+_replay: Optional[TranscriptReplay] = None
+
+
+def _reset_after_fork():
+    global _executor, _clients_lock, _cache
+    _executor = None
+    _cache = None
+    _clients.clear()
+    _clients_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def set_base_url(base_url: Optional[str]):
+    global _base_url
+    _base_url = base_url
+    _clients.clear()
+
+
+def get_client(model: str, api_key_env: str):
+    key = (model, api_key_env)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                if _base_url:
+                    client = ChatClient(_base_url, model, api_key=os.getenv(api_key_env))
+                else:
+                    from oai_client import OpenAIClient
+                    client = OpenAIClient(model=model, api_key=os.getenv(api_key_env))
+                _clients[key] = client
+    return client
+
+
+def configure_cache(path: Optional[str], max_entries: Optional[int] = None, max_age_days: Optional[float] = None,
+                    run_id: Optional[str] = None):
+    global _cache_config, _cache
+    _cache_config = None
+    if path:
+        _cache_config = {"path": path, "max_entries": max_entries, "max_age_days": max_age_days,
+                         "run_id": run_id}
+    _cache = None
+
+
+def get_cache() -> Optional[ResponseCache]:
+    global _cache
+    if _cache is None and _cache_config is not None:
+        _cache = ResponseCache(**_cache_config)
+    return _cache
+
+
+def configure_transcript(record: Optional[str] = None, replay: Optional[str] = None):
+    global _recorder, _replay
+    _recorder = TranscriptRecorder(record) if record else None
+    _replay = TranscriptReplay(replay) if replay else None
+    if _replay is not None:
+        print(f"Replaying {len(_replay)} recorded responses from {replay}")
+
+
+def provider_of(api_key_env: str) -> str:
+    return api_key_env.lower().replace("_api_key", "")
+
+
+def set_request_threads(n: int):
+    global _executor, _request_threads
+    _request_threads = n
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=_request_threads, thread_name_prefix="llm")
+    return _executor
+
+
+def _timed(call: Callable[[], str]) -> Tuple[str, float]:
+    started = time.monotonic()
+    return call(), time.monotonic() - started
+
+
+async def _in_thread(call: Callable[[], str]) -> Tuple[str, float]:
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), _timed, call)
+
+
+async def _awaited(call: Callable[[], Awaitable[str]]) -> Tuple[str, float]:
+    started = time.monotonic()
+    return await call(), time.monotonic() - started
+
+
+async def _first_token_logprobs(client: ChatClient, messages: List[Dict[str, str]], max_new_tokens: int,
+                                temperature: float, top_logprobs: int) -> str:
+    completion = await client.acreate(messages, max_new_tokens, temperature, logprobs=True,
+                                      top_logprobs=top_logprobs)
+    content = completion["choices"][0]["logprobs"]["content"]
+    candidates = content[0]["top_logprobs"] if content else []
+    return json.dumps({candidate["token"]: candidate["logprob"] for candidate in candidates}, ensure_ascii=False)
+
+
+def _client_call(model: str, api_key_env: str, messages: List[Dict[str, str]], max_new_tokens: int,
+                 temperature: float, extra: Dict[str, Any]) -> Callable[[], Awaitable[Tuple[str, float]]]:
+    client = get_client(model, api_key_env)
+    if not isinstance(client, ChatClient):
+        if extra.get("top_logprobs"):
+            raise ValueError("logprob scoring needs an OpenAI-compatible endpoint (--base-url)")
+        return functools.partial(_in_thread, functools.partial(client.call_oai, messages, max_new_tokens=max_new_tokens,
+                                                               temperature=temperature))
+    if extra.get("top_logprobs"):
+        return functools.partial(_awaited, functools.partial(_first_token_logprobs, client, messages, max_new_tokens,
+                                                             temperature, extra["top_logprobs"]))
+    kwargs = {}
+    if extra.get("response_format"):
+        kwargs["response_format"] = extra["response_format"]
+    return functools.partial(_awaited, functools.partial(client.acall_oai, messages, max_new_tokens=max_new_tokens,
+                                                         temperature=temperature, **kwargs))
+
+
+async def _call_client(model: str, api_key_env: str, messages: List[Dict[str, str]],
+                       max_new_tokens: int, temperature: float, extra: Dict[str, Any]) -> str:
+    call = _client_call(model, api_key_env, messages, max_new_tokens, temperature, extra)
+    provider = provider_of(api_key_env)
+    limiter = rate_limit.get_limiter(provider)
+    tokens = rate_limit.estimate_tokens(messages, max_new_tokens)
+    policy = retry.request_policy
+    for attempt in range(1, policy.max_attempts + 1):
+        try:
+            async with limiter.slot(tokens):
+                stats.add_gauge(f"requests_in_flight_{provider}", 1)
+                try:
+                    with telemetry.span("request", provider=provider, model=model, attempt=attempt):
+                        response, latency = await call()
+                finally:
+                    stats.add_gauge(f"requests_in_flight_{provider}", -1)
+                stats.observe(f"latency_{provider}", latency)
+                stats.incr(f"requests_{provider}")
+                stats.incr(f"tokens_{provider}", tokens)
+                return response
+        except Exception as e:
+            stats.incr(f"request_errors_{provider}")
+            if attempt == policy.max_attempts or not rate_limit.is_throttle(e):
+                raise
+        stats.incr("request_retries")
+        with telemetry.span("retry_backoff", provider=provider):
+            await policy.sleep(attempt)
+
+
+async def call_llm(model: str, api_key_env: str, messages: List[Dict[str, str]],
+                   max_new_tokens: int, temperature: float, **extra: Any) -> str:
+    if _replay is None and _recorder is None:
+        return await _call_cached(model, api_key_env, messages, max_new_tokens, temperature, extra)
+
+    key = ResponseCache.key(model, messages, temperature, max_new_tokens, extra)
+    sample = _recorder.claim(key) if _recorder is not None else None
+    if _replay is not None:
+        response = _replay.get(key)
+    else:
+        response = await _call_cached(model, api_key_env, messages, max_new_tokens, temperature, extra)
+    if _recorder is not None:
+        _recorder.record(key, sample, model, messages, temperature, max_new_tokens, response)
+    return response
+
+
+async def top_logprobs(model: str, api_key_env: str, messages: List[Dict[str, str]],
+                       num_candidates: int = 20, temperature: float = 1) -> Dict[str, float]:
+    response = await call_llm(model, api_key_env, messages, max_new_tokens=1, temperature=temperature,
+                              top_logprobs=num_candidates)
+    return json.loads(response)
+
+
+async def _call_cached(model: str, api_key_env: str, messages: List[Dict[str, str]],
+                       max_new_tokens: int, temperature: float, extra: Dict[str, Any]) -> str:
+    cache = get_cache()
+    if cache is None:
+        return await _call_client(model, api_key_env, messages, max_new_tokens, temperature, extra)
+
+    # SQLite can wait up to its busy timeout on another process's write lock, so every cache
+    # call runs on the executor rather than stalling the event loop.
+    loop = asyncio.get_running_loop()
+    key = cache.key(model, messages, temperature, max_new_tokens, extra)
+    with telemetry.span("cache_claim"):
+        sample_index, response = await loop.run_in_executor(_get_executor(), cache.claim, key)
+    if response is not None:
+        return response
+    try:
+        response = await _call_client(model, api_key_env, messages, max_new_tokens, temperature, extra)
+    except BaseException:
+        await loop.run_in_executor(_get_executor(), cache.release, key, sample_index)
+        raise
+    await loop.run_in_executor(_get_executor(), cache.put, key, sample_index, response)
+    return response
@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+import checkpoint
+import input_reader
+
+Location = Tuple[bool, str, int, int]
+
+
+def index_records(paths: List[str]) -> Dict[Any, Location]:
+    best: Dict[Any, Location] = {}
+    for path in paths:
+        for segment, offset, line in checkpoint.iter_line_offsets(path):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            ok = not checkpoint.is_error_record(record)
+            current = best.get(record.get('id'))
+            if current is None or ok or not current[0]:
+                best[record.get('id')] = (ok, segment, offset, len(line))
+    return best
+
+
+def merge(paths: List[str], input_path: str, merged_path: str) -> Dict[str, int]:
+    best = index_records(paths)
+    counts = {"records": len(best), "failed": sum(1 for ok, *_ in best.values() if not ok), "extra": 0}
+    files = {}
+
+    def read(location: Location) -> bytes:
+        _, segment, offset, length = location
+        if segment not in files:
+            files[segment] = os.open(segment, os.O_RDONLY)
+        return os.pread(files[segment], length, offset)
+
+    def lines():
+        for item in input_reader.iter_items(input_path):
+            location = best.pop(item.get('id'), None)
+            if location is not None:
+                yield read(location)
+        counts["extra"] = len(best)
+        for location in best.values():
+            yield read(location)
+
+    try:
+        checkpoint.rewrite(merged_path, lines())
+    finally:
+        for fd in files.values():
+            os.close(fd)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the shard checkpoints of a --shard run into one ordered output")
+    parser.add_argument("output", help="unsharded output path of the script, e.g. comments/distributional_moral_scenarios.json")
+    parser.add_argument("--input", required=True, help="input file the shards were read from, used for record order")
+    parser.add_argument("--shards", nargs="*", default=None,
+                        help="shard checkpoints to merge (default: every <output>.shard-*-of-*.jsonl)")
+    args = parser.parse_args()
+
+    merged_path = checkpoint.checkpoint_path(args.output)
+    paths = args.shards if args.shards is not None else checkpoint.shard_checkpoint_paths(args.output)
+    if not paths:
+        parser.error(f"no shard checkpoints found next to {args.output}")
+    if checkpoint.segment_paths(merged_path) and merged_path not in paths:
+        paths = [merged_path] + paths
+
+    counts = merge(paths, args.input, merged_path)
+    exported = checkpoint.export_json(merged_path, args.output)
+    print(f"Merged {counts['records']} records ({counts['failed']} failed, {counts['extra']} not in input) "
+          f"from {len(paths)} checkpoints; exported {exported} to {args.output}")
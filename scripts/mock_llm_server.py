@@ -0,0 +1,165 @@
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_NUM_GROUPS = re.compile(r'Generate (\d+) contrasting')
+_NUM_JOINT = re.compile(r'exactly (\d+) entries')
+_OPTIONS = "ABC"
+
+_VALUES = ["Autonomy", "Beneficence", "Justice", "Non-maleficence", "Dignity", "Solidarity", "Care", "Honesty"]
+_FRAMEWORKS = ["Deontology", "Utilitarianism", "Virtue Ethics", "Care Ethics", "Contractualism", "Principlism"]
+_STAKEHOLDERS = ["Patient", "Physician", "Nurse", "Family Member", "Hospital Administrator", "Public Health Officer"]
+
+
+class MockConfig:
+    def __init__(self, latency_mean: float, latency_sigma: float, error_rate: float, throttle_rate: float,
+                 short_seed_rate: float, invalid_comment_rate: float = 0.0):
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.short_seed_rate = short_seed_rate
+        self.invalid_comment_rate = invalid_comment_rate
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def latency(self) -> float:
+        if self.latency_sigma <= 0 or self.latency_mean <= 0:
+            return max(self.latency_mean, 0.0)
+        return random.lognormvariate(math.log(self.latency_mean) - self.latency_sigma ** 2 / 2, self.latency_sigma)
+
+
+def seed_response(prompt: str, short: bool) -> str:
+    match = _NUM_GROUPS.search(prompt)
+    num_groups = int(match.group(1)) if match else 6
+    if short:
+        num_groups = max(0, num_groups - random.randint(1, num_groups))
+    lines = []
+    for i in range(num_groups):
+        lines.append(f"#Persona {i + 1}: {random.choice(_VALUES)}, {random.choice(_FRAMEWORKS)}, "
+                     f"Duty of {random.choice(_VALUES).lower()}, {random.choice(['Compassion', 'Concern', 'Resolve'])}, "
+                     f"{random.choice(_STAKEHOLDERS)}")
+    return "Here are the perspectives:\n" + "\n".join(lines)
+
+
+def comment_response() -> str:
+    option = random.choice(_OPTIONS)
+    values = ", ".join(random.sample(_VALUES, 3))
+    return (f"{option}. The core moral values involved are {values}. "
+            "Clinicians must respect the patient's rights while honoring their duty of care, "
+            "and institutions should ensure decisions are fair and transparent.")
+
+
+def joint_response(num_seeds: int, invalid_rate: float) -> str:
+    comments = [{"perspective": i + 1, "comment": "" if random.random() < invalid_rate else comment_response()}
+                for i in range(num_seeds)]
+    return json.dumps({"comments": comments})
+
+
+def top_logprobs(num_candidates: int) -> list:
+    tokens = list(_OPTIONS) + ["D", "**", "The", "Option"]
+    logits = [random.gauss(0, 2) + (3 if token in _OPTIONS else 0) for token in tokens]
+    norm = math.log(sum(math.exp(logit) for logit in logits))
+    candidates = [{"token": token, "logprob": logit - norm} for token, logit in zip(tokens, logits)]
+    return sorted(candidates, key=lambda candidate: -candidate["logprob"])[:num_candidates]
+
+
+def completion(model: str, content: str, logprobs: list = None) -> dict:
+    choice = {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}
+    if logprobs is not None:
+        choice["logprobs"] = {"content": [{"token": content, "logprob": logprobs[0]["logprob"], "top_logprobs": logprobs}]}
+    return {
+        "id": f"mock-{random.getrandbits(64):x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [choice],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(content) // 4, "total_tokens": len(content) // 4},
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes on a keep-alive connection; without TCP_NODELAY,
+    # Nagle plus delayed ACK adds ~40 ms to every response.
+    disable_nagle_algorithm = True
+    config: MockConfig
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        config = self.config
+        with config.lock:
+            config.requests += 1
+        time.sleep(config.latency())
+
+        roll = random.random()
+        if roll < config.throttle_rate:
+            return self._reply(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}})
+        if roll < config.throttle_rate + config.error_rate:
+            return self._reply(500, {"error": {"message": "Internal server error", "type": "server_error"}})
+
+        prompt = body.get("messages", [{}])[-1].get("content", "")
+        if body.get("logprobs"):
+            candidates = top_logprobs(body.get("top_logprobs") or 1)
+            return self._reply(200, completion(body.get("model", "mock"), candidates[0]["token"], candidates))
+        joint = _NUM_JOINT.search(prompt)
+        if joint:
+            content = joint_response(int(joint.group(1)), config.invalid_comment_rate)
+        elif _NUM_GROUPS.search(prompt):
+            content = seed_response(prompt, random.random() < config.short_seed_rate)
+        else:
+            content = comment_response()
+        self._reply(200, completion(body.get("model", "mock"), content))
+
+
+class MockServer(ThreadingHTTPServer):
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up before the delayed reply is written.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(host: str, port: int, config: MockConfig) -> ThreadingHTTPServer:
+    handler = type("MockHandler", (Handler,), {"config": config})
+    return MockServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stand-in for the DeepSeek/Qwen endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--latency-mean", type=float, default=0.5, help="mean response latency in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal sigma of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--short-seed-rate", type=float, default=0.0,
+                        help="fraction of seed responses with fewer '#' lines than requested")
+    parser.add_argument("--invalid-comment-rate", type=float, default=0.0,
+                        help="fraction of comments left empty in joint (structured) responses")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, MockConfig(args.latency_mean, args.latency_sigma, args.error_rate,
+                                                    args.throttle_rate, args.short_seed_rate,
+                                                    args.invalid_comment_rate))
+    print(f"Mock LLM server listening on http://{args.host}:{server.server_port}/v1")
+    server.serve_forever()
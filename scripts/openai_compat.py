@@ -0,0 +1,164 @@
+import asyncio
+import http.client
+import json
+import ssl
+import threading
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+class APIError(Exception):
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"Error code: {status_code} - {body[:500]}")
+        self.status_code = status_code
+        self.body = body
+
+
+class ChatClient:
+    """Minimal OpenAI-compatible chat completions client.
+
+    The blocking methods keep one keep-alive connection per thread. The async
+    methods speak HTTP/1.1 over asyncio streams with a pool of idle keep-alive
+    connections per event loop, so requests in flight cost sockets, not threads.
+    """
+
+    def __init__(self, base_url: str, model: str, api_key: Optional[str] = None, timeout: float = 600):
+        parts = urlsplit(base_url)
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path.rstrip("/") + "/chat/completions"
+        self._local = threading.local()
+        self._idle: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, List[Tuple]]" = weakref.WeakKeyDictionary()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = cls(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _reset(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    def _post(self, body: bytes) -> Tuple[int, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request("POST", self.path, body=body, headers=headers)
+                response = conn.getresponse()
+                return response.status, response.read().decode("utf-8")
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self._reset()
+                if attempt:
+                    raise
+            except BaseException:
+                # A timeout or protocol error leaves the connection mid-request; reusing it would
+                # fail every later call on this thread with CannotSendRequest.
+                self._reset()
+                raise
+
+    def create(self, messages: List[Dict[str, str]], max_new_tokens: int, temperature: float,
+               **extra: Any) -> Dict[str, Any]:
+        payload = {"model": self.model, "messages": messages, "max_tokens": max_new_tokens,
+                   "temperature": temperature, **extra}
+        status, body = self._post(json.dumps(payload).encode("utf-8"))
+        if status >= 400:
+            raise APIError(status, body)
+        return json.loads(body)
+
+    def _request_head(self, length: int) -> bytes:
+        host = self.host if self.port is None else f"{self.host}:{self.port}"
+        lines = [f"POST {self.path} HTTP/1.1", f"Host: {host}", "Content-Type: application/json",
+                 "Accept: application/json", f"Content-Length: {length}"]
+        if self.api_key:
+            lines.append(f"Authorization: Bearer {self.api_key}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _open(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        port = self.port or (443 if self.https else 80)
+        return await asyncio.open_connection(self.host, port, ssl=ssl.create_default_context() if self.https else None)
+
+    @staticmethod
+    async def _read_response(reader: asyncio.StreamReader) -> Tuple[int, bool, bytes]:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed before the response")
+        version, status = status_line.decode("latin-1").split(" ", 2)[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body, keep_alive = await reader.read(), False
+        return int(status), keep_alive, body
+
+    async def _apost(self, body: bytes) -> Tuple[int, str]:
+        idle = self._idle.setdefault(asyncio.get_running_loop(), [])
+        for attempt in range(2):
+            reused = bool(idle)
+            reader, writer = idle.pop() if reused else await asyncio.wait_for(self._open(), self.timeout)
+            try:
+                writer.write(self._request_head(len(body)) + body)
+                status, keep_alive, payload = await asyncio.wait_for(self._read_response(reader), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # An idle keep-alive connection may have been closed by the server; retry once on a new one.
+                if reused and not attempt:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                idle.append((reader, writer))
+            else:
+                writer.close()
+            return status, payload.decode("utf-8")
+
+    async def acreate(self, messages: List[Dict[str, str]], max_new_tokens: int, temperature: float,
+                      **extra: Any) -> Dict[str, Any]:
+        payload = {"model": self.model, "messages": messages, "max_tokens": max_new_tokens,
+                   "temperature": temperature, **extra}
+        status, body = await self._apost(json.dumps(payload).encode("utf-8"))
+        if status >= 400:
+            raise APIError(status, body)
+        return json.loads(body)
+
+    async def acall_oai(self, messages: List[Dict[str, str]], max_new_tokens: int = 512, temperature: float = 1,
+                        **extra: Any) -> str:
+        completion = await self.acreate(messages, max_new_tokens, temperature, **extra)
+        return completion["choices"][0]["message"]["content"]
+
+    def call_oai(self, messages: List[Dict[str, str]], max_new_tokens: int = 512, temperature: float = 1,
+                 **extra: Any) -> str:
+        completion = self.create(messages, max_new_tokens, temperature, **extra)
+        return completion["choices"][0]["message"]["content"]
@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import math
+import string
+from typing import Callable, Dict, List, Optional
+
+import llm
+import stats
+
+SCORE_INSTRUCTION = "\nRespond with only the letter of the chosen option."
+
+
+def add_score_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--score-mode", choices=["generate", "logprobs"], default="generate",
+                        help="generate: full-text comments per persona; logprobs: one-token request per persona, "
+                             "reading next-token logprobs over the option letters into pred_distribution")
+    parser.add_argument("--score-comments", action="store_true",
+                        help="with --score-mode logprobs, also generate the full-text comments as a second pass")
+    parser.add_argument("--top-logprobs", type=int, default=20,
+                        help="candidate tokens requested per scoring call")
+
+
+def check_args(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    if args.score_mode == "logprobs" and not (args.base_url or args.replay):
+        parser.error("--score-mode logprobs needs an OpenAI-compatible endpoint (--base-url) or --replay")
+
+
+def option_letters(options: Optional[List[str]]) -> str:
+    return string.ascii_uppercase[:len(options)] if options else "ABC"
+
+
+def option_probabilities(logprobs: Dict[str, float], letters: str) -> Optional[List[float]]:
+    mass = dict.fromkeys(letters, 0.0)
+    for token, logprob in logprobs.items():
+        letter = token.strip().strip("(.):*").upper()
+        if letter in mass:
+            mass[letter] += math.exp(logprob)
+    total = sum(mass.values())
+    if total <= 0:
+        return None
+    return [mass[letter] / total for letter in letters]
+
+
+def aggregate(vectors: List[Optional[List[float]]]) -> Optional[List[float]]:
+    scored = [vector for vector in vectors if vector is not None]
+    if not scored:
+        return None
+    return [sum(column) / len(scored) for column in zip(*scored)]
+
+
+async def score_options(messages: List[Dict[str, str]], letters: str, model: str, api_key_env: str,
+                        num_candidates: int = 20) -> Optional[List[float]]:
+    messages = messages[:-1] + [dict(messages[-1], content=messages[-1]["content"] + SCORE_INSTRUCTION)]
+    probabilities = option_probabilities(await llm.top_logprobs(model, api_key_env, messages, num_candidates), letters)
+    stats.incr("option_scores" if probabilities is not None else "option_score_misses")
+    return probabilities
+
+
+async def score_seeds(build_messages: Callable[[str], List[Dict[str, str]]], seeds: List[str], letters: str,
+                      model: str, api_key_env: str, num_candidates: int = 20) -> List[Optional[List[float]]]:
+    return await asyncio.gather(*(
+        score_options(build_messages(seed), letters, model, api_key_env, num_candidates)
+        for seed in seeds
+    ))
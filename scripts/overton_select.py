@@ -0,0 +1,200 @@
+import argparse
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+    from scipy import sparse
+    from sklearn.feature_extraction.text import TfidfVectorizer
+except ImportError:
+    raise ImportError("overton_select.py needs numpy, scipy and scikit-learn: pip install numpy scipy scikit-learn")
+
+import checkpoint
+import comment_models
+import evaluate
+
+
+def vrd_texts(vrd: Any) -> List[str]:
+    if not vrd:
+        return []
+    if isinstance(vrd, (str, dict)):
+        vrd = [vrd]
+    texts = []
+    for entry in vrd:
+        if isinstance(entry, dict):
+            entry = " ".join(str(entry[key]) for key in ("vrd", "text", "explanation") if entry.get(key))
+        if entry:
+            texts.append(str(entry))
+    return texts
+
+
+def usable(record: Dict[str, Any]) -> bool:
+    return any(isinstance(comment, dict) for comment in record.get('comments') or [])
+
+
+def _group_pairs(a_group: np.ndarray, b_start: np.ndarray, b_count: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    reps = b_count[a_group]
+    a_index = np.repeat(np.arange(len(a_group)), reps)
+    offsets = np.arange(reps.sum()) - np.repeat(np.cumsum(reps) - reps, reps)
+    return a_index, np.repeat(b_start[a_group], reps) + offsets
+
+
+def _row_dots(matrix: sparse.csr_matrix, x_rows: np.ndarray, y_rows: np.ndarray) -> np.ndarray:
+    if not len(x_rows):
+        return np.zeros(0)
+    return np.asarray(matrix[x_rows].multiply(matrix[y_rows]).sum(axis=1)).ravel()
+
+
+def _group_argmax(scores: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    order = np.lexsort((-scores, groups))
+    _, first = np.unique(groups[order], return_index=True)
+    return order[first]
+
+
+class Corpus:
+    def __init__(self):
+        self.num_items = 0
+        self.situation_row: List[int] = []
+        self.comment_row: List[int] = []
+        self.comment_item: List[int] = []
+        self.comment_valid: List[bool] = []
+        self.vrd_row: List[int] = []
+        self.vrd_item: List[int] = []
+
+    def texts(self, records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+        row = 0
+        for record in records:
+            if not usable(record):
+                continue
+            item = self.num_items
+            self.num_items += 1
+            self.situation_row.append(row)
+            row += 1
+            yield record.get('situation') or ''
+            for text in vrd_texts(record.get('vrd')):
+                self.vrd_row.append(row)
+                self.vrd_item.append(item)
+                row += 1
+                yield text
+            for comment in record['comments']:
+                text = evaluate.comment_text(comment.get('comment')) if isinstance(comment, dict) else ''
+                self.comment_row.append(row)
+                self.comment_item.append(item)
+                self.comment_valid.append(bool(text.strip()))
+                row += 1
+                yield text
+
+
+def select(matrix: sparse.csr_matrix, corpus: Corpus, top_k: int, relevance_weight: float, redundancy_weight: float,
+           block_size: int = 4096) -> Dict[str, np.ndarray]:
+    comment_row = np.asarray(corpus.comment_row, dtype=np.int64)
+    comment_item = np.asarray(corpus.comment_item, dtype=np.int64)
+    valid = np.asarray(corpus.comment_valid, dtype=bool)
+    vrd_row = np.asarray(corpus.vrd_row, dtype=np.int64)
+    vrd_item = np.asarray(corpus.vrd_item, dtype=np.int64)
+    situation_row = np.asarray(corpus.situation_row, dtype=np.int64)
+    order = np.full(len(comment_item), -1, dtype=np.int64)
+    redundancy = np.zeros(len(comment_item))
+    vrd_coverage = np.zeros(corpus.num_items)
+
+    for lo in range(0, corpus.num_items, block_size):
+        hi = min(lo + block_size, corpus.num_items)
+        c_lo, c_hi = np.searchsorted(comment_item, [lo, hi])
+        v_lo, v_hi = np.searchsorted(vrd_item, [lo, hi])
+        items, rows = comment_item[c_lo:c_hi] - lo, comment_row[c_lo:c_hi]
+        v_items, v_rows = vrd_item[v_lo:v_hi] - lo, vrd_row[v_lo:v_hi]
+        n = hi - lo
+
+        comment_count = np.bincount(items, minlength=n)
+        comment_start = np.cumsum(comment_count) - comment_count
+        vrd_count = np.bincount(v_items, minlength=n)
+        vrd_start = np.cumsum(vrd_count) - vrd_count
+
+        cv_comment, cv_vrd = _group_pairs(items, vrd_start, vrd_count)
+        cv_sim = _row_dots(matrix, rows[cv_comment], v_rows[cv_vrd])
+        cc_a, cc_b = _group_pairs(items, comment_start, comment_count)
+        distinct = cc_a != cc_b
+        cc_a, cc_b = cc_a[distinct], cc_b[distinct]
+        cc_sim = _row_dots(matrix, rows[cc_a], rows[cc_b])
+        relevance = _row_dots(matrix, rows, situation_row[lo:hi][items])
+
+        covered = np.zeros(len(v_items))
+        block_redundancy = np.zeros(len(items))
+        block_order = np.full(len(items), -1, dtype=np.int64)
+        for step in range(top_k):
+            coverage_gain = np.bincount(cv_comment, weights=np.maximum(cv_sim - covered[cv_vrd], 0.0),
+                                        minlength=len(items))
+            gain = coverage_gain + relevance_weight * relevance - redundancy_weight * block_redundancy
+            gain[(block_order >= 0) | ~valid[c_lo:c_hi]] = -np.inf
+            best = _group_argmax(gain, items)
+            best = best[np.isfinite(gain[best])]
+            if not len(best):
+                break
+            block_order[best] = step
+            newly = block_order[cv_comment] == step
+            np.maximum.at(covered, cv_vrd[newly], cv_sim[newly])
+            newly = block_order[cc_b] == step
+            np.maximum.at(block_redundancy, cc_a[newly], cc_sim[newly])
+
+        order[c_lo:c_hi] = block_order
+        redundancy[c_lo:c_hi] = block_redundancy
+        coverage = np.bincount(v_items, weights=covered, minlength=n)
+        vrd_coverage[lo:hi] = np.divide(coverage, vrd_count, out=np.zeros(n), where=vrd_count > 0)
+    return {"order": order, "redundancy": redundancy, "vrd_coverage": vrd_coverage}
+
+
+def summary_input(situation: str, comments: List[str]) -> str:
+    perspectives = "\n".join(f"{i}. {comment}" for i, comment in enumerate(comments, 1))
+    return f'Situation: "{situation}"\n\nPerspectives:\n{perspectives}'
+
+
+def select_results(path: str, top_k: int = 4, relevance_weight: float = 0.1, redundancy_weight: float = 0.5,
+                   block_size: int = 4096, model: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    corpus = Corpus()
+    vectorizer = TfidfVectorizer(sublinear_tf=True, stop_words='english', dtype=np.float32)
+    records = comment_models.selecting(checkpoint.iter_results(path), model)
+    matrix = vectorizer.fit_transform(corpus.texts(records)).tocsr()
+    result = select(matrix, corpus, top_k, relevance_weight, redundancy_weight, block_size)
+
+    start = 0
+    records = (record for record in comment_models.selecting(checkpoint.iter_results(path), model) if usable(record))
+    for item, record in enumerate(records):
+        count = len(record['comments'])
+        steps = result["order"][start:start + count]
+        picked = [int(i) for i in np.argsort(steps, kind="stable") if steps[i] >= 0]
+        comments = [evaluate.comment_text(record['comments'][i].get('comment')) for i in picked]
+        yield {
+            "id": record['id'],
+            "situation": record.get('situation'),
+            "vrd": record.get('vrd'),
+            "selected": picked,
+            "selected_seeds": [record['comments'][i].get('seed') for i in picked],
+            "vrd_coverage": float(result["vrd_coverage"][item]),
+            "redundancy": [float(result["redundancy"][start + i]) for i in picked],
+            "summary_input": summary_input(record.get('situation') or '', comments),
+        }
+        start += count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Select a diverse, vrd-covering subset of Overton comments per "
+                                                 "situation and emit the combined summary input")
+    parser.add_argument("results", help="checkpoint (.jsonl) or exported results (.json)")
+    parser.add_argument("output", help="JSONL file of selections")
+    parser.add_argument("--top-k", type=int, default=4, help="comments kept per situation")
+    parser.add_argument("--relevance-weight", type=float, default=0.1,
+                        help="weight of a comment's similarity to the situation")
+    parser.add_argument("--redundancy-weight", type=float, default=0.5,
+                        help="penalty on a comment's similarity to comments already selected")
+    parser.add_argument("--block-size", type=int, default=4096, help="items per vectorized similarity block")
+    parser.add_argument("--model", default=None,
+                        help="comment model to select from in --comment-models results (default: the first listed)")
+    args = parser.parse_args()
+
+    count = 0
+    with open(args.output, 'w') as f:
+        for selection in select_results(args.results, args.top_k, args.relevance_weight, args.redundancy_weight,
+                                        args.block_size, args.model):
+            f.write(json.dumps(selection, ensure_ascii=False) + "\n")
+            count += 1
+    print(f"Wrote {count} selections to {args.output}")
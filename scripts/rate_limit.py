@@ -0,0 +1,149 @@
+import asyncio
+import collections
+import re
+import time
+from typing import Dict, List, Optional
+
+import stats
+import telemetry
+
+_THROTTLE_PATTERN = re.compile(r'\b(?:error code|status(?: code)?)\W*(?:429|5\d\d)\b|rate.?limit|too many requests|overloaded',
+                               re.I)
+
+
+def is_throttle(e: BaseException) -> bool:
+    status = getattr(e, 'status_code', None) or getattr(e, 'status', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return bool(_THROTTLE_PATTERN.search(f"{type(e).__name__} {e}"))
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_new_tokens: int) -> int:
+    return sum(len(message['content']) for message in messages) // 4 + max_new_tokens
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    async def acquire(self, n: float):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= min(n, self.capacity)
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class ProviderLimiter:
+    def __init__(self, name: str, max_concurrency: int, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 min_concurrency: int = 1, latency_factor: float = 2.0, cooldown: float = 5.0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.baseline_latency: Optional[float] = None
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._waiters = collections.deque()
+
+    async def _acquire_slot(self):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _on_success(self, latency: float):
+        if self.baseline_latency is None:
+            self.baseline_latency = latency
+        healthy = latency <= self.latency_factor * self.baseline_latency
+        self.baseline_latency += 0.05 * (latency - self.baseline_latency)
+        if healthy and self.limit < self.max_concurrency:
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            self._wake()
+
+    def _on_throttle(self):
+        stats.incr(f"throttled_{self.name}")
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            self._last_decrease = now
+
+    def slot(self, tokens: int) -> "_Slot":
+        return _Slot(self, tokens)
+
+
+class _Slot:
+    def __init__(self, limiter: ProviderLimiter, tokens: int):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.started = 0.0
+
+    async def __aenter__(self):
+        with telemetry.span("limiter_wait", provider=self.limiter.name):
+            if self.limiter.requests is not None:
+                await self.limiter.requests.acquire(1)
+            if self.limiter.tokens is not None:
+                await self.limiter.tokens.acquire(self.tokens)
+            await self.limiter._acquire_slot()
+        self.started = time.monotonic()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.limiter._release_slot()
+        if exc is None:
+            self.limiter._on_success(time.monotonic() - self.started)
+        elif is_throttle(exc):
+            self.limiter._on_throttle()
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+_rpm: Dict[str, float] = {}
+_tpm: Dict[str, float] = {}
+_max_concurrency: Dict[str, int] = {}
+_default_concurrency = 1024
+
+
+def configure(max_concurrency: Dict[str, int], rpm: Dict[str, float], tpm: Dict[str, float],
+              default_concurrency: int):
+    global _max_concurrency, _rpm, _tpm, _default_concurrency
+    _limiters.clear()
+    _max_concurrency = dict(max_concurrency)
+    _rpm = dict(rpm)
+    _tpm = dict(tpm)
+    _default_concurrency = default_concurrency
+
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        limiter = ProviderLimiter(provider, _max_concurrency.get(provider, _default_concurrency),
+                                  rpm=_rpm.get(provider), tpm=_tpm.get(provider))
+        _limiters[provider] = limiter
+    return limiter
@@ -0,0 +1,116 @@
+import hashlib
+import itertools
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import stats
+
+
+class ResponseCache:
+    """SQLite cache of LLM responses keyed by request hash and sampling index.
+
+    Identical requests are sampled independently at temperature > 0, so the
+    n-th identical request issued during a run is served from sampling slot n.
+    A slot is claimed by at most one request per run, which keeps duplicate
+    prompts within a run distinct while re-runs replay the same samples.
+    """
+
+    def __init__(self, path: str, max_entries: Optional[int] = None, max_age_days: Optional[float] = None,
+                 run_id: Optional[str] = None, evict_every: int = 1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400 if max_age_days is not None else None
+        self.run_id = run_id or uuid.uuid4().hex
+        self.evict_every = evict_every
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT NOT NULL, sample_index INTEGER NOT NULL, response TEXT, "
+            "created REAL NOT NULL, accessed REAL NOT NULL, run_id TEXT, "
+            "PRIMARY KEY (key, sample_index))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.evict()
+
+    @staticmethod
+    def key(model: str, messages: List[Dict[str, str]], temperature: float, max_new_tokens: int,
+            extra: Optional[Dict[str, Any]] = None) -> str:
+        request = [model, messages, temperature, max_new_tokens] + ([extra] if extra else [])
+        payload = json.dumps(request,
+                             sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def claim(self, key: str) -> Tuple[int, Optional[str]]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sample_index in itertools.count():
+                    row = self._conn.execute(
+                        "SELECT response, created, run_id FROM responses WHERE key = ? AND sample_index = ?",
+                        (key, sample_index),
+                    ).fetchone()
+                    if row is not None and row[2] == self.run_id:
+                        continue
+                    expired = row is not None and self.max_age is not None and now - row[1] > self.max_age
+                    if row is None or row[0] is None or expired:
+                        self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, NULL, ?, ?, ?)",
+                                           (key, sample_index, now, now, self.run_id))
+                        response = None
+                    else:
+                        self._conn.execute(
+                            "UPDATE responses SET accessed = ?, run_id = ? WHERE key = ? AND sample_index = ?",
+                            (now, self.run_id, key, sample_index),
+                        )
+                        response = row[0]
+                    break
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        stats.incr("cache_misses" if response is None else "cache_hits")
+        return sample_index, response
+
+    def put(self, key: str, sample_index: int, response: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE responses SET response = ?, created = ?, accessed = ? WHERE key = ? AND sample_index = ?",
+                (response, now, now, key, sample_index),
+            )
+            self._puts += 1
+            due = self._puts % self.evict_every == 0
+        if due:
+            self.evict()
+
+    def release(self, key: str, sample_index: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ? AND sample_index = ? AND response IS NULL",
+                               (key, sample_index))
+
+    def evict(self):
+        with self._lock:
+            if self.max_age is not None:
+                cursor = self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+                if cursor.rowcount > 0:
+                    stats.incr("cache_evictions", cursor.rowcount)
+            if self.max_entries is not None:
+                cursor = self._conn.execute(
+                    "DELETE FROM responses WHERE rowid IN ("
+                    "SELECT rowid FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                if cursor.rowcount > 0:
+                    stats.incr("cache_evictions", cursor.rowcount)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,214 @@
+import argparse
+import json
+import mmap
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+_decoder = json.JSONDecoder()
+_ID_PREFIX = '{"id": '
+
+Location = Tuple[str, int, int]
+
+
+def index_path(path: str) -> str:
+    return path + ".idx"
+
+
+def line_id(line: str):
+    if line.startswith(_ID_PREFIX):
+        return _decoder.raw_decode(line, len(_ID_PREFIX))[0]
+    return json.loads(line).get('id')
+
+
+def _scan(segment: str, start: int = 0) -> Iterator[Tuple[Any, int, int]]:
+    with open(segment, 'rb') as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                item_id = line_id(line.decode('utf-8'))
+            except (json.JSONDecodeError, AttributeError, UnicodeDecodeError):
+                item_id = None
+            yield item_id, offset, len(line)
+            offset += len(line)
+
+
+def _read_entries(path: str) -> Optional[Dict[str, List[list]]]:
+    try:
+        with open(index_path(path), 'r', encoding='utf-8') as f:
+            content = f.read()
+        if content and not content.endswith("\n"):
+            return None
+        entries = json.loads("[" + content[:-1].replace("\n", ",") + "]")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    segments: Dict[str, List[list]] = {}
+    live: List[list] = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            segments[f"{path}.{entry.get('rotated')}"] = live
+            live = []
+        else:
+            live.append(entry)
+    segments[path] = live
+    return segments
+
+
+class IndexWriter:
+    """Appends `[id, offset, length]` per checkpoint line to `<checkpoint>.idx`.
+
+    Entries always describe the live file; a `{"rotated": N}` line moves every
+    entry since the previous marker to segment N.
+    """
+
+    def __init__(self, path: str, segments: List[str]):
+        self.path = path
+        catch_up(path, segments)
+        self._file = open(index_path(path), 'a', encoding='utf-8')
+
+    def add(self, item_id: Any, offset: int, length: int):
+        self._file.write(json.dumps([item_id, offset, length], ensure_ascii=False) + "\n")
+
+    def rotated(self, number: int):
+        self._file.write(json.dumps({"rotated": number}) + "\n")
+        self._file.flush()
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _rebuild(path: str, segments: List[str]):
+    tmp_path = index_path(path) + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for segment in segments:
+            for entry in _scan(segment):
+                f.write(json.dumps(list(entry), ensure_ascii=False) + "\n")
+            if segment != path:
+                f.write(json.dumps({"rotated": int(segment.rsplit(".", 1)[1])}) + "\n")
+    os.replace(tmp_path, index_path(path))
+
+
+def catch_up(path: str, segments: List[str]) -> Dict[str, List[list]]:
+    entries = _read_entries(path)
+    if entries is None or any(segment not in segments for segment, rows in entries.items() if rows):
+        if not segments:
+            if os.path.exists(index_path(path)):
+                os.remove(index_path(path))
+            return {}
+        _rebuild(path, segments)
+        return _read_entries(path)
+
+    for segment in segments:
+        rows = entries.get(segment, [])
+        end = rows[-1][1] + rows[-1][2] if rows else 0
+        size = os.path.getsize(segment)
+        if end == size:
+            continue
+        if end > size or segment != path:
+            _rebuild(path, segments)
+            return _read_entries(path)
+        tail = [list(entry) for entry in _scan(segment, end)]
+        with open(index_path(path), 'a', encoding='utf-8') as f:
+            for entry in tail:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        rows.extend(tail)
+        entries[segment] = rows
+    return entries
+
+
+class ResultIndex:
+    """Random access to checkpoint records by id through the `.idx` sidecar.
+
+    get() is one pread, get_many() sorts the reads by file position, and
+    iter_records() walks the memory-mapped segments in file order. When an id
+    was written more than once, the last record wins.
+    """
+
+    def __init__(self, path: str, segments: List[str]):
+        self.path = path
+        self.segments = segments
+        self._locations: Dict[Any, Location] = {}
+        for segment, rows in catch_up(path, segments).items():
+            for item_id, offset, length in rows:
+                if item_id is not None:
+                    self._locations[item_id] = (segment, offset, length)
+        self._fds: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def __contains__(self, item_id: Any) -> bool:
+        return item_id in self._locations
+
+    def ids(self) -> Iterable[Any]:
+        return self._locations.keys()
+
+    def _read(self, location: Location) -> Dict[str, Any]:
+        segment, offset, length = location
+        if segment not in self._fds:
+            self._fds[segment] = os.open(segment, os.O_RDONLY)
+        return json.loads(os.pread(self._fds[segment], length, offset))
+
+    def get(self, item_id: Any) -> Optional[Dict[str, Any]]:
+        location = self._locations.get(item_id)
+        return self._read(location) if location is not None else None
+
+    def get_many(self, item_ids: Iterable[Any]) -> List[Optional[Dict[str, Any]]]:
+        item_ids = list(item_ids)
+        order = sorted((self._locations[item_id], i) for i, item_id in enumerate(item_ids)
+                       if item_id in self._locations)
+        records: List[Optional[Dict[str, Any]]] = [None] * len(item_ids)
+        for location, i in order:
+            records[i] = self._read(location)
+        return records
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        by_segment: Dict[str, List[Tuple[int, int]]] = {}
+        for segment, offset, length in self._locations.values():
+            by_segment.setdefault(segment, []).append((offset, length))
+        for segment in self.segments:
+            spans = sorted(by_segment.get(segment, ()))
+            if not spans:
+                continue
+            with open(segment, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for offset, length in spans:
+                    yield json.loads(mm[offset:offset + length])
+
+    def close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _parse_id(value: str):
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+if __name__ == "__main__":
+    import checkpoint
+
+    parser = argparse.ArgumentParser(description="Print checkpoint records by id using the offset index")
+    parser.add_argument("results", help="checkpoint (.jsonl) or the script output path it belongs to")
+    parser.add_argument("ids", nargs="*", help="ids to print (JSON values, e.g. 17 or '\"abc\"'); none prints a summary")
+    args = parser.parse_args()
+
+    path = args.results if args.results.endswith(".jsonl") else checkpoint.checkpoint_path(args.results)
+    with checkpoint.open_index(path) as index:
+        if not args.ids:
+            print(f"{len(index)} ids indexed in {index_path(path)}")
+        for item_id, record in zip(args.ids, index.get_many(_parse_id(item_id) for item_id in args.ids)):
+            print(json.dumps(record, ensure_ascii=False) if record is not None else f"{item_id}: not found")
@@ -0,0 +1,37 @@
+import asyncio
+import random
+
+
+class RetriesExhausted(Exception):
+    pass
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 30.0, jitter: float = 0.5):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, retry_number: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** (retry_number - 1))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def sleep(self, retry_number: int):
+        await asyncio.sleep(self.delay(retry_number))
+
+
+seed_policy = RetryPolicy()
+seed_top_up = False
+request_policy = RetryPolicy(max_attempts=6)
+
+
+def configure_seeds(policy: RetryPolicy, top_up: bool):
+    global seed_policy, seed_top_up
+    seed_policy = policy
+    seed_top_up = top_up
+
+
+def configure_requests(policy: RetryPolicy):
+    global request_policy
+    request_policy = policy
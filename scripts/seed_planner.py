@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import re
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import item_journal
+import retry
+import stats
+import telemetry
+import transcript
+
+
+def normalize(text: str) -> str:
+    return re.sub(r'\s+', ' ', text or '').strip().casefold()
+
+
+class SeedPlan:
+    def __init__(self, items: Iterable[Dict[str, Any]], seed_text: Callable[[Dict[str, Any]], str],
+                 generate: Callable[[str], Awaitable[List[str]]], journal: Optional[item_journal.ItemJournal] = None):
+        self.seed_text = seed_text
+        self.generate = generate
+        self.members: Counter = Counter()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._preloaded: Dict[str, List[str]] = {}
+        for item in items:
+            key = self.group(item)
+            self.members[key] += 1
+            # A group whose member already has journaled seeds reuses them instead of a new call.
+            seeds = journal.recorded_seeds(item.get('id')) if journal is not None else None
+            if seeds is not None:
+                self._preloaded.setdefault(key, seeds)
+        self._remaining = Counter(self.members)
+
+    @property
+    def num_items(self) -> int:
+        return sum(self.members.values())
+
+    @property
+    def calls_saved(self) -> int:
+        return self.num_items - len(self.members)
+
+    def group(self, item: Dict[str, Any]) -> str:
+        return normalize(self.seed_text(item))
+
+    def report(self) -> str:
+        return (f"Seed plan: {self.num_items} items share {len(self.members)} seed groups "
+                f"({self.calls_saved} seed calls saved)")
+
+    def export(self, item: Dict[str, Any]) -> Tuple[str, Optional[List[str]]]:
+        """The item's group and its seeds, if this process generated them successfully."""
+        key = self.group(item)
+        task = self._tasks.get(key)
+        if task is None or not task.done() or task.cancelled() or task.exception() is not None:
+            return key, self._preloaded.get(key)
+        return key, task.result()
+
+    def preload(self, item: Dict[str, Any], seeds: List[str]):
+        """Serve the item's group from seeds generated in another process."""
+        self._preloaded[self.group(item)] = seeds
+
+    def finish(self, item: Dict[str, Any]):
+        """Called once per item after its last attempt; the group's seeds are dropped after its last item."""
+        key = self.group(item)
+        self._remaining[key] -= 1
+        if self._remaining[key] <= 0:
+            self._tasks.pop(key, None)
+            self._preloaded.pop(key, None)
+
+    async def seeds(self, text: str) -> List[str]:
+        key = normalize(text)
+        if key in self._preloaded:
+            stats.incr("seed_calls_saved")
+            return self._preloaded[key]
+        task = self._tasks.get(key)
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            stats.incr("seed_calls")
+            task = asyncio.ensure_future(self._generate(key, text))
+            self._tasks[key] = task
+        else:
+            stats.incr("seed_calls_saved")
+        return await asyncio.shield(task)
+
+    async def _generate(self, key: str, text: str) -> List[str]:
+        with transcript.scope("seeds:" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]):
+            return await self.generate(text)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_tasks'] = {}
+        state['_preloaded'] = {}
+        return state
+
+
+async def collect_seed_groups(request: Callable[[int, List[str]], Awaitable[List[str]]], num_groups: int) -> List[str]:
+    policy = retry.seed_policy
+    groups: List[str] = []
+    for attempt in range(1, policy.max_attempts + 1):
+        if attempt > 1:
+            print(f"Warning: Generated {len(groups)} groups, retrying.")
+            stats.incr("seed_retries")
+            with telemetry.span("seed_backoff"):
+                await policy.sleep(attempt - 1)
+
+        if not retry.seed_top_up:
+            groups = await request(num_groups, [])
+            if len(groups) >= num_groups:
+                return groups
+            continue
+
+        new_groups = await request(num_groups - len(groups), groups)
+        groups.extend(new_groups[:num_groups - len(groups)])
+        if len(groups) >= num_groups:
+            return groups
+        stats.incr("seed_groups_salvaged", len(new_groups))
+
+    stats.incr("seed_give_ups")
+    raise retry.RetriesExhausted(f"only {len(groups)} of {num_groups} seed groups after {policy.max_attempts} attempts")
@@ -0,0 +1,584 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from typing import Callable, Dict, List, Tuple
+
+import checkpoint
+import compact_schema
+import engine
+import evaluate
+import input_reader
+import item_journal
+import merge_shards
+import mock_llm_server
+import option_scoring
+import rate_limit
+import result_index
+import retry
+import seed_planner
+from openai_compat import ChatClient
+from response_cache import ResponseCache
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+
+
+def _poll_items(num_items: int, num_questions: int) -> List[Dict]:
+    countries = ["US", "Germany", "Japan", "Brazil", "India", "Nigeria", "France", "Mexico"]
+    return [{"id": i, "question": f"Should hospitals disclose error rate {i % num_questions}?",
+             "options": ["Yes", "No", "Unsure"], "attribute": countries[i % len(countries)],
+             "gold_distribution": [0.5, 0.3, 0.2]} for i in range(num_items)]
+
+
+def _run_script(script: str, workdir: str, *args: str):
+    subprocess.run([sys.executable, os.path.join(SCRIPTS, script), *args], cwd=workdir, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def _run_poll(workdir: str, items: List[Dict], *args: str, config: mock_llm_server.MockConfig = None,
+              keep: bool = False) -> Tuple[Dict[str, int], List[Dict]]:
+    config = config or mock_llm_server.MockConfig(0.01, 1.0, 0.0, 0.0, 0.0)
+    server = mock_llm_server.serve("127.0.0.1", 0, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    input_path = os.path.join(workdir, "poll.json")
+    stats_path = os.path.join(workdir, "stats.json")
+    checkpoint_path = os.path.join(workdir, "comments", "distributional_poll_questions.jsonl")
+    with open(input_path, 'w') as f:
+        json.dump(items, f)
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    try:
+        _run_script("generate_distributional_comments_poll_questions.py", workdir, "--input", input_path,
+                    "--stats-out", stats_path, "--base-url", f"http://127.0.0.1:{server.server_port}/v1", *args)
+    finally:
+        server.shutdown()
+    with open(stats_path) as f:
+        counters = json.load(f)["counters"]
+    records = list(checkpoint.iter_records(checkpoint_path))
+    if not keep:
+        shutil.rmtree(os.path.dirname(checkpoint_path))
+    return counters, records
+
+
+def _run_poll_mp(workdir: str, items: List[Dict], *args: str) -> Tuple[Dict[str, int], List[Dict]]:
+    return _run_poll(workdir, items, "--engine", "mp", "--workers", "4", "--start-method", "spawn", *args)
+
+
+def _seed_sets(records: List[Dict]) -> Dict[str, set]:
+    sets: Dict[str, set] = {}
+    for record in records:
+        sets.setdefault(record["question"], set()).add(tuple(comment["seed"] for comment in record["comments"]))
+    return sets
+
+
+def check_record_replay(workdir: str):
+    server = mock_llm_server.serve("127.0.0.1", 0, mock_llm_server.MockConfig(0.05, 1.0, 0.0, 0.0, 0.0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        input_path = os.path.join(workdir, "poll.json")
+        with open(input_path, 'w') as f:
+            json.dump(_poll_items(40, 5), f)
+        transcript = os.path.join(workdir, "transcript.jsonl")
+        checkpoint = os.path.join(workdir, "comments", "distributional_poll_questions.jsonl")
+        outputs = []
+        for mode in (["--base-url", f"http://127.0.0.1:{server.server_port}/v1", "--record", transcript],
+                     ["--replay", transcript]):
+            os.makedirs(os.path.dirname(checkpoint), exist_ok=True)
+            _run_script("generate_distributional_comments_poll_questions.py", workdir, "--input", input_path,
+                        "--concurrency", "16", *mode)
+            with open(checkpoint) as f:
+                outputs.append(sorted(f))
+            shutil.rmtree(os.path.dirname(checkpoint))
+    finally:
+        server.shutdown()
+    assert len(outputs[0]) == 40, f"recorded {len(outputs[0])} of 40 items"
+    assert not any('"Error occurred"' in line for line in outputs[1]), "replay produced error records"
+    assert outputs[0] == outputs[1], "replayed results differ from the recorded run"
+
+
+def check_client_timeout(workdir: str):
+    config = mock_llm_server.MockConfig(0.6, 0.0, 0.0, 0.0, 0.0)
+    server = mock_llm_server.serve("127.0.0.1", 0, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = ChatClient(f"http://127.0.0.1:{server.server_port}/v1", "mock", timeout=0.3)
+    messages = [{"role": "user", "content": "Is this a retry?"}]
+    try:
+        try:
+            client.call_oai(messages)
+            raise AssertionError("the slow request did not time out")
+        except TimeoutError:
+            pass
+        config.latency_mean = 0.0
+        assert client.call_oai(messages), "empty reply after a timeout"
+
+        async def call_async():
+            config.latency_mean = 0.6
+            try:
+                await client.acall_oai(messages)
+                raise AssertionError("the slow async request did not time out")
+            except asyncio.TimeoutError:
+                pass
+            config.latency_mean = 0.0
+            return await client.acall_oai(messages)
+
+        assert asyncio.run(call_async()), "empty async reply after a timeout"
+    finally:
+        server.shutdown()
+
+
+def _record(item_id: int, failed: bool = False) -> Dict:
+    return {"id": item_id, "question": f"q{item_id}", "comments": ["Error occurred"] if failed else [f"c{item_id}"]}
+
+
+def _write_checkpoint(path: str, records: List[Dict], **kwargs):
+    with checkpoint.JsonlCheckpoint(path, **kwargs) as sink:
+        for record in records:
+            sink.append(record)
+
+
+def _assert_index(path: str, expected: List[Dict]):
+    with checkpoint.open_index(path) as index:
+        assert set(index.ids()) == {record["id"] for record in expected}, f"index lists {sorted(index.ids())}"
+        for record in expected:
+            assert index.get(record["id"]) == record, f"index returned {index.get(record['id'])} for id {record['id']}"
+
+
+def check_torn_tail(workdir: str):
+    path = os.path.join(workdir, "results.jsonl")
+    records = [_record(i) for i in range(6)]
+    for torn in (b'{"id": 5, "question": "q5", "comm', b'{"id": 5, "question": "' + b"x" * 200000):
+        _write_checkpoint(path, records[:5])
+        with open(path, 'ab') as f:
+            f.write(torn)
+        _write_checkpoint(path, records[5:])
+        assert list(checkpoint.iter_records(path)) == records, "torn tail survived the reopen"
+        _assert_index(path, records)
+        os.remove(path)
+        os.remove(result_index.index_path(path))
+
+
+def check_stale_index(workdir: str):
+    path = os.path.join(workdir, "results.jsonl")
+    idx = result_index.index_path(path)
+    records = [_record(i) for i in range(12)]
+
+    def reset(**kwargs):
+        for segment in checkpoint.segment_paths(path) + [idx]:
+            os.remove(segment)
+        _write_checkpoint(path, records, **kwargs)
+
+    _write_checkpoint(path, records)
+    with open(idx) as f:
+        lines = f.readlines()
+    with open(idx, 'w') as f:
+        f.writelines(lines[:4])
+    _assert_index(path, records)
+
+    reset()
+    with open(idx, 'a') as f:
+        f.write('[12, 9999')
+    _assert_index(path, records)
+
+    reset()
+    with open(path, 'rb') as f:
+        lines = f.readlines()
+    with open(path, 'wb') as f:
+        f.writelines(lines[:-1])
+    _assert_index(path, records[:-1])
+
+    reset(max_bytes=200)
+    assert len(checkpoint.segment_paths(path)) > 2, "checkpoint did not rotate"
+    with open(idx) as f:
+        lines = [line for line in f if not line.startswith('{"rotated"')]
+    with open(idx, 'w') as f:
+        f.writelines(lines)
+    _assert_index(path, records)
+
+
+def check_atomic_rewrite(workdir: str):
+    path = os.path.join(workdir, "results.jsonl")
+    records = [_record(i, failed=i % 3 == 0) for i in range(30)]
+    _write_checkpoint(path, records, max_bytes=400)
+    segments = checkpoint.segment_paths(path)
+    assert len(segments) > 2, "checkpoint did not rotate"
+    before = {segment: open(segment, 'rb').read() for segment in segments}
+
+    def failing_lines():
+        yield b'{"id": 0}\n'
+        raise OSError("disk full")
+
+    try:
+        checkpoint.rewrite(path, failing_lines())
+    except OSError:
+        pass
+    assert {segment: open(segment, 'rb').read() for segment in checkpoint.segment_paths(path)} == before, \
+        "an interrupted rewrite changed the checkpoint"
+
+    with checkpoint.ReplacementSink(path) as sink:
+        for record in records:
+            if checkpoint.is_error_record(record):
+                sink.append(_record(record["id"], failed=record["id"] == 0))
+    assert sink.replaced == 9, f"replaced {sink.replaced} of 9 records"
+    expected = [_record(i, failed=i == 0) for i in range(30)]
+    assert checkpoint.segment_paths(path) == [path], f"stale segments left: {checkpoint.segment_paths(path)}"
+    assert not os.path.exists(path + ".retry"), "replacement file left behind"
+    assert list(checkpoint.iter_records(path)) == expected, "rewrite changed the record order or content"
+    assert checkpoint.scan_failed_ids(path) == {0}, f"failed ids after rewrite: {checkpoint.scan_failed_ids(path)}"
+    _assert_index(path, expected)
+
+
+def check_rotation_export(workdir: str):
+    path = os.path.join(workdir, "results.jsonl")
+    records = [_record(i) for i in range(40)]
+    _write_checkpoint(path, records[:25], max_bytes=300)
+    _write_checkpoint(path, records[25:], max_bytes=300)
+    assert len(checkpoint.segment_paths(path)) > 2, "checkpoint did not rotate"
+    assert checkpoint.scan_ids(path) == set(range(40)), f"resume scan found {sorted(checkpoint.scan_ids(path))}"
+    output = os.path.join(workdir, "results.json")
+    assert checkpoint.export(path, output) == 40, "export dropped records"
+    with open(output) as f:
+        assert json.load(f) == records, "export changed the record order or content"
+
+
+def check_retry_failed(workdir: str):
+    items = _poll_items(20, 5)
+    path = os.path.join(workdir, "comments", "distributional_poll_questions.jsonl")
+    config = mock_llm_server.MockConfig(0.0, 0.0, 0.05, 0.0, 0.0)
+    flaky = ("--request-max-attempts", "1", "--seed-max-attempts", "1")
+    _, first = _run_poll(workdir, items, *flaky, config=config, keep=True)
+    failed = {record["id"] for record in first if checkpoint.is_error_record(record)}
+    assert failed and len(failed) < 20, f"{len(failed)} of 20 items failed; the check needs some of both"
+    with open(checkpoint.dead_letter_path(path)) as f:
+        dead_letters = {entry["id"]: entry for entry in map(json.loads, f)}
+    assert set(dead_letters) == failed, f"dead letters for {sorted(dead_letters)}, failed {sorted(failed)}"
+    assert all(entry["error_type"] and entry["attempts"] == 1 for entry in dead_letters.values()), "dead letter fields"
+
+    config.error_rate = 0.0
+    config.requests = 0
+    _, retried = _run_poll(workdir, items, "--retry-failed", config=config, keep=True)
+    assert [record["id"] for record in retried] == [record["id"] for record in first], "the swap reordered records"
+    assert not any(checkpoint.is_error_record(record) for record in retried), "placeholders survived the retry"
+    kept = [record for record in first if record["id"] not in failed]
+    assert [record for record in retried if record["id"] not in failed] == kept, "the retry touched finished items"
+    assert config.requests <= 7 * len(failed), f"{config.requests} requests to retry {len(failed)} items"
+    assert not os.path.exists(checkpoint.dead_letter_path(path)), "retried items stayed in the dead-letter log"
+    shutil.rmtree(os.path.dirname(path))
+
+
+def check_journal_resume(workdir: str):
+    path = os.path.join(workdir, "comments", "distributional_poll_questions.jsonl")
+    seeds = [f"Persona {i}: Care, Deontology, Duty of care, Concern, Nurse" for i in range(6)]
+    done = [[{"role": "user", "content": f"prompt {i}"}, {"role": "assistant", "content": f"A. journaled {i}"}]
+            for i in range(4)]
+    os.makedirs(os.path.dirname(path))
+    with open(checkpoint.journal_path(path), 'w') as f:
+        f.write(json.dumps({"id": 0, "seeds": seeds}) + "\n")
+        f.writelines(json.dumps({"id": 0, "index": i, "comment": messages}) + "\n" for i, messages in enumerate(done))
+    counters, records = _run_poll(workdir, _poll_items(5, 5), keep=True)
+    resumed = next(record for record in records if record["id"] == 0)
+    assert [comment["seed"] for comment in resumed["comments"]] == seeds, "the resumed item regenerated its seeds"
+    assert [comment["comment"] for comment in resumed["comments"][:4]] == done, "journaled comments were redone"
+    assert (counters.get("requests_deepseek"), counters.get("requests_qwen")) == (4, 26), \
+        f"requests_deepseek={counters.get('requests_deepseek')} requests_qwen={counters.get('requests_qwen')}"
+    assert not os.path.exists(checkpoint.journal_path(path)), "the journal outlived a run with no failures"
+    shutil.rmtree(os.path.dirname(path))
+
+
+def check_cache_run_id(workdir: str):
+    path = os.path.join(workdir, "cache.sqlite")
+    first, second = ResponseCache(path, run_id="run-1"), ResponseCache(path, run_id="run-1")
+    assert first.claim("k") == (0, None) and second.claim("k") == (1, None), "one run claimed a slot twice"
+    first.put("k", 0, "r0")
+    second.put("k", 1, "r1")
+    rerun = ResponseCache(path, run_id="run-2")
+    claims = [rerun.claim("k") for _ in range(3)]
+    assert claims == [(0, "r0"), (1, "r1"), (2, None)], f"a new run claimed {claims}"
+    rerun.release("k", 2)
+    rerun.release("k", 0)
+    rows = rerun._conn.execute("SELECT sample_index FROM responses WHERE key = 'k' ORDER BY sample_index").fetchall()
+    assert rows == [(0,), (1,)], f"release left slots {rows}: it must drop only unfilled ones"
+
+    counters, records = _run_poll_mp(workdir, _poll_items(16, 2), "--cache", path + ".run")
+    assert counters.get("cache_hits", 0) == 0, f"an empty cache served {counters['cache_hits']} hits"
+    distinct = {question: len(sets) for question, sets in _seed_sets(records).items()}
+    assert set(distinct.values()) == {8}, f"spawn workers shared samples within a run: {distinct}"
+
+
+def check_seed_dedupe(workdir: str):
+    counters, records = _run_poll_mp(workdir, _poll_items(40, 5), "--dedupe-seeds")
+    assert (counters.get("seed_calls"), counters.get("seed_calls_saved")) == (5, 35), \
+        f"seed_calls={counters.get('seed_calls')} seed_calls_saved={counters.get('seed_calls_saved')}"
+    distinct = {question: len(sets) for question, sets in _seed_sets(records).items()}
+    assert len(records) == 40 and set(distinct.values()) == {1}, f"groups did not share their seeds: {distinct}"
+
+    items = _poll_items(6, 2)
+    calls: List[str] = []
+
+    async def generate(text: str) -> List[str]:
+        calls.append(text)
+        return [f"seed {len(calls)}"]
+
+    async def attempts():
+        plan = seed_planner.SeedPlan(items, lambda item: item["question"], generate)
+        for item in items:
+            await plan.seeds(item["question"])
+            await plan.seeds(item["question"])
+            plan.finish(item)
+
+    asyncio.run(attempts())
+    assert len(calls) == 2, f"item retries cost {len(calls) - 2} extra seed calls"
+
+    journal_path = os.path.join(workdir, "journal.jsonl")
+    with open(journal_path, 'w') as f:
+        f.write(json.dumps({"id": 0, "seeds": ["journaled"]}) + "\n")
+    plan = seed_planner.SeedPlan(items, lambda item: item["question"], generate,
+                                 journal=item_journal.ItemJournal(journal_path))
+    dispatched: List = []
+    feeder = threading.Thread(target=lambda: dispatched.extend(engine._GroupDispatch(plan).tasks(items)), daemon=True)
+    feeder.start()
+    feeder.join(5)
+    journaled = [seeds for item, seeds in dispatched if item["question"] == items[0]["question"]]
+    assert journaled == [["journaled"]] * 3, f"a group with journaled seeds was held back: {journaled}"
+
+
+def check_seed_top_up(workdir: str):
+    requests: List[Tuple[int, int]] = []
+
+    async def request(num_groups: int, existing: List[str]) -> List[str]:
+        requests.append((num_groups, len(existing)))
+        return [f"group {len(existing) + i}" for i in range(min(num_groups, 4))]
+
+    saved = retry.seed_policy, retry.seed_top_up
+    try:
+        retry.configure_seeds(retry.RetryPolicy(max_attempts=3, base_delay=0.0), top_up=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            groups = asyncio.run(seed_planner.collect_seed_groups(request, 6))
+        assert groups == [f"group {i}" for i in range(6)], f"top-up returned {groups}"
+        assert requests == [(6, 0), (2, 4)], f"top-up requests (groups asked, groups kept): {requests}"
+
+        requests.clear()
+        retry.configure_seeds(retry.RetryPolicy(max_attempts=3, base_delay=0.0), top_up=False)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                asyncio.run(seed_planner.collect_seed_groups(request, 6))
+            raise AssertionError("a seed request that always falls short did not give up")
+        except retry.RetriesExhausted:
+            pass
+        assert requests == [(6, 0)] * 3, f"requests without top-up: {requests}"
+    finally:
+        retry.configure_seeds(*saved)
+
+
+def check_shard_merge(workdir: str):
+    input_path = os.path.join(workdir, "input.json")
+    output_path = os.path.join(workdir, "results.json")
+    with open(input_path, 'w') as f:
+        json.dump([{"id": i} for i in range(30)], f)
+    paths = []
+    for index in range(3):
+        path = checkpoint.checkpoint_path(checkpoint.shard_output_path(output_path, (index, 3)))
+        owned = [i for i in reversed(range(30)) if input_reader.in_shard(i, (index, 3))]
+        records = [_record(i, failed=i == 7) for i in owned]
+        if index == 0:
+            records += [_record(7), _record(99)]
+        _write_checkpoint(path, records)
+        paths.append(path)
+    assert checkpoint.shard_checkpoint_paths(output_path) == paths, "shard checkpoints were not found"
+
+    merged_path = checkpoint.checkpoint_path(output_path)
+    counts = merge_shards.merge(paths, input_path, merged_path)
+    expected = [_record(i) for i in range(30)] + [_record(99)]
+    assert counts == {"records": 31, "failed": 0, "extra": 1}, f"merge counts {counts}"
+    assert list(checkpoint.iter_records(merged_path)) == expected, "merge lost the input order or kept a placeholder"
+
+
+def check_input_stream(workdir: str):
+    items = [{"id": i, "question": f'He said "[{i}], {{ok}}" \\ ' + "x" * (i * 7), "options": ["A, B", "]"]}
+             for i in range(50)]
+    array_path, jsonl_path = os.path.join(workdir, "items.json"), os.path.join(workdir, "items.jsonl")
+    with open(array_path, 'w') as f:
+        json.dump(items, f, indent=2)
+    with open(jsonl_path, 'w') as f:
+        f.writelines(json.dumps(item) + "\n\n" for item in items)
+    for chunk_size in (1, 7, 1 << 16):
+        assert list(input_reader.iter_items(array_path, chunk_size)) == items, f"array read with chunks of {chunk_size}"
+    assert list(input_reader.iter_items(jsonl_path)) == items, "JSONL read"
+
+    def ids(**kwargs):
+        return [item["id"] for item in input_reader.read_items(array_path, **kwargs)]
+
+    assert ids(offset=5, limit=10, skip_ids={6}) == [5] + list(range(7, 15)), "offset/limit/skip"
+    assert ids(id_range="10:13") == [10, 11, 12], "id range"
+    sample = ids(sample=0.5)
+    assert sample == ids(sample=0.5) and 0 < len(sample) < 50, "sample is not a stable subset"
+    shards = [ids(shard=(index, 4)) for index in range(4)]
+    assert sorted(sum(shards, [])) == list(range(50)), "shards overlap or miss items"
+
+
+def check_limiter(workdir: str):
+    limiter = rate_limit.ProviderLimiter("mock", max_concurrency=4, cooldown=60)
+    peak = in_flight = 0
+
+    async def request(delay: float, fail: bool = False):
+        nonlocal peak, in_flight
+        try:
+            async with limiter.slot(10):
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(delay)
+                in_flight -= 1
+                if fail:
+                    raise RuntimeError("Error code: 429 - rate limit")
+        except RuntimeError:
+            pass
+
+    async def run():
+        await asyncio.gather(*(request(0.01) for _ in range(20)))
+        assert peak == 4 and limiter.limit == 4, f"peak {peak}, limit {limiter.limit} with a ceiling of 4"
+        await asyncio.gather(request(0.01, fail=True), request(0.01, fail=True))
+        assert limiter.limit == 2, f"two throttles within the cooldown left the limit at {limiter.limit}"
+        await asyncio.gather(*(request(0.01) for _ in range(20)))
+        assert 2 < limiter.limit <= 4, f"the limit did not grow back after healthy responses: {limiter.limit}"
+
+    asyncio.run(run())
+
+    rate_limit.configure({"mock": 4}, rpm={"mock": 60.0}, tpm={}, default_concurrency=8)
+    rate_limit.configure({}, rpm={}, tpm={}, default_concurrency=8)
+    reconfigured = rate_limit.get_limiter("mock")
+    assert (reconfigured.max_concurrency, reconfigured.requests) == (8, None), \
+        f"a reconfigured limiter kept the old limits: max {reconfigured.max_concurrency}, rpm {reconfigured.requests}"
+
+
+def check_option_probabilities(workdir: str):
+    logprobs = {"A": math.log(0.4), " B": math.log(0.2), "(C)": math.log(0.2), "D": math.log(0.1), "The": math.log(0.1)}
+    probabilities = option_scoring.option_probabilities(logprobs, "ABC")
+    assert all(abs(p - q) < 1e-9 for p, q in zip(probabilities, [0.5, 0.25, 0.25])), f"probabilities {probabilities}"
+    assert option_scoring.option_probabilities({"The": 0.0}, "ABC") is None, "a reply with no option letter scored"
+    assert option_scoring.aggregate([[1.0, 0.0], None, [0.0, 1.0]]) == [0.5, 0.5], "unscored personas were averaged in"
+
+    counters, records = _run_poll(workdir, _poll_items(10, 5), "--score-mode", "logprobs")
+    assert (counters.get("requests_qwen"), counters.get("option_scores")) == (60, 60), \
+        f"requests_qwen={counters.get('requests_qwen')} option_scores={counters.get('option_scores')}"
+    for record in records:
+        vectors = [comment["option_probs"] for comment in record["comments"]]
+        assert all(len(vector) == 3 and abs(sum(vector) - 1) < 1e-9 for vector in vectors), f"item {record['id']}"
+        assert record["pred_distribution"] == option_scoring.aggregate(vectors), f"item {record['id']} aggregate"
+
+
+def check_compact_round_trip(workdir: str):
+    items = _poll_items(12, 3)
+    transcript = os.path.join(workdir, "transcript.jsonl")
+    output = os.path.join(workdir, "comments", "distributional_poll_questions.json")
+    sizes, loaded = [], []
+    for mode in (["--output-format", "compact", "--record", transcript], ["--replay", transcript]):
+        _run_poll(workdir, items, *mode, keep=True)
+        sizes.append(os.path.getsize(output))
+        loaded.append(sorted(compact_schema.load(output), key=lambda record: record["id"]))
+        shutil.rmtree(os.path.dirname(output))
+    assert loaded[0] == loaded[1], "compact records did not load back to the full messages"
+    assert sizes[0] < sizes[1] / 2, f"compact export is {sizes[0]} B against {sizes[1]} B in full"
+
+
+def check_joint_comments(workdir: str):
+    config = mock_llm_server.MockConfig(0.0, 0.0, 0.0, 0.0, 0.0, invalid_comment_rate=0.3)
+    counters, records = _run_poll(workdir, _poll_items(20, 5), "--comment-mode", "joint", config=config)
+    texts = [evaluate.comment_text(comment["comment"]) for record in records for comment in record["comments"]]
+    assert len(records) == 20 and len(texts) == 120 and all(texts), "joint mode left items or comments incomplete"
+    assert counters.get("joint_rerequests", 0) > 0, "no invalid perspective was re-requested"
+    expected = 20 + 20 + counters["joint_rerequests"]
+    assert config.requests == expected, f"{config.requests} requests for 20 seed calls, 20 joint calls and " \
+                                        f"{counters['joint_rerequests']} re-requests"
+
+
+def check_model_fan_out(workdir: str):
+    models = ["Qwen2.5-7B", "Llama-3-8B"]
+    config = mock_llm_server.MockConfig(0.0, 0.0, 0.0, 0.0, 0.0)
+    counters, records = _run_poll(workdir, _poll_items(8, 4), "--comment-models", *models, config=config)
+    assert (counters.get("requests_deepseek"), config.requests) == (8, 8 + 2 * 6 * 8), \
+        f"{counters.get('requests_deepseek')} seed calls, {config.requests} requests for 8 items and 2 models"
+    for record in records:
+        assert list(record["models"]) == models, f"item {record['id']} has models {list(record['models'])}"
+        seeds = [[comment["seed"] for comment in record["models"][model]["comments"]] for model in models]
+        assert len(seeds[0]) == 6 and seeds[0] == seeds[1], f"item {record['id']} models saw different seeds"
+
+
+def check_evaluate(workdir: str):
+    path = os.path.join(workdir, "results.jsonl")
+
+    def comment(seed: str, reply: str) -> Dict:
+        return {"seed": seed, "comment": [{"role": "user", "content": "q"}, {"role": "assistant", "content": reply}]}
+
+    records = [
+        {"id": 0, "options": ["Yes", "No", "Unsure"], "gold_distribution": [0.5, 0.5, 0.0],
+         "comments": [comment("A, Patient", "A. Yes."), comment("B, Nurse", "**B** because"),
+                      comment("C, Nurse", "no option given")]},
+        {"id": 1, "options": ["Yes", "No"], "gold_distribution": [0.0, 1.0],
+         "comments": [{"seed": "A, Patient", "option_probs": [0.25, 0.75]}]},
+        _record(2, failed=True),
+    ]
+    _write_checkpoint(path, records)
+    output = os.path.join(workdir, "preds.jsonl")
+    summary = evaluate.evaluate(path, output_path=output)
+    assert (summary["items"], summary["evaluated"], summary["accuracy"]) == (2, 2, 1.0), f"summary {summary}"
+    with open(output) as f:
+        preds = {record["id"]: record for record in map(json.loads, f)}
+    assert preds[0]["pred_distribution"] == [0.5, 0.5, 0.0] and preds[0]["js"] < 1e-9, f"item 0: {preds[0]}"
+    assert preds[1]["pred_distribution"] == [0.25, 0.75], f"item 1: {preds[1]}"
+    weighted = evaluate.evaluate(path, weights={"patient": 3.0})
+    assert weighted["js_divergence"] > summary["js_divergence"], "persona weights did not change the prediction"
+    replies = {"I think so": None, "A patient may": None, "I) yes": 8, "Answer: J": 9, "K - sure": 10, "L": 11}
+    parsed = {reply: evaluate.leading_option(reply, 12) for reply in replies}
+    assert parsed == replies, f"leading options on 12 choices: {parsed}"
+
+
+CHECKS: Dict[str, Callable[[str], None]] = {
+    "record_replay": check_record_replay,
+    "client_timeout": check_client_timeout,
+    "torn_tail": check_torn_tail,
+    "stale_index": check_stale_index,
+    "atomic_rewrite": check_atomic_rewrite,
+    "rotation_export": check_rotation_export,
+    "retry_failed": check_retry_failed,
+    "journal_resume": check_journal_resume,
+    "cache_run_id": check_cache_run_id,
+    "seed_dedupe": check_seed_dedupe,
+    "seed_top_up": check_seed_top_up,
+    "shard_merge": check_shard_merge,
+    "input_stream": check_input_stream,
+    "limiter": check_limiter,
+    "compact_round_trip": check_compact_round_trip,
+    "joint_comments": check_joint_comments,
+    "option_probabilities": check_option_probabilities,
+    "model_fan_out": check_model_fan_out,
+    "evaluate": check_evaluate,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run self-contained checks against a mock server and temporary files")
+    parser.add_argument("checks", nargs="*", help=f"checks to run (default: all of {', '.join(CHECKS)})")
+    args = parser.parse_args()
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks: {' '.join(unknown)}")
+
+    failed = 0
+    for name in args.checks or CHECKS:
+        with tempfile.TemporaryDirectory() as workdir:
+            try:
+                CHECKS[name](workdir)
+                print(f"ok      {name}")
+            except Exception as e:
+                failed += 1
+                detail = e.stderr.decode(errors="replace").strip().splitlines()[-1:] if isinstance(
+                    e, subprocess.CalledProcessError) and e.stderr else [
+                    str(e) if isinstance(e, AssertionError) else f"{type(e).__name__}: {e}"]
+                print(f"FAIL    {name}: {' '.join(detail)}")
+    sys.exit(1 if failed else 0)
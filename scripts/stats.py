@@ -0,0 +1,146 @@
+import json
+import math
+import os
+import resource
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+_BUCKET_BASE = 1.1
+_BUCKET_FLOOR = 1e-3
+
+_counters = Counter()
+_histograms: Dict[str, Counter] = defaultdict(Counter)
+_sums = Counter()
+_gauges = Counter()
+_source_gauges: Dict[Any, Dict[str, float]] = {}
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+    _sums.clear()
+    _gauges.clear()
+    _source_gauges.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def process_age() -> Optional[float]:
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+def incr(name: str, n: int = 1):
+    with _lock:
+        _counters[name] += n
+
+
+def get(name: str) -> int:
+    return _counters[name]
+
+
+def add_gauge(name: str, delta: float):
+    with _lock:
+        _gauges[name] += delta
+
+
+def set_gauge(name: str, value: float):
+    with _lock:
+        _gauges[name] = value
+
+
+def _all_gauges() -> Dict[str, float]:
+    gauges = dict(_gauges)
+    for source in list(_source_gauges.values()):
+        for name, value in source.items():
+            gauges[name] = gauges.get(name, 0) + value
+    return gauges
+
+
+def _bucket(value: float) -> int:
+    if value <= _BUCKET_FLOOR:
+        return 0
+    return int(math.ceil(math.log(value / _BUCKET_FLOOR, _BUCKET_BASE)))
+
+
+def bucket_upper(index: int) -> float:
+    return _BUCKET_FLOOR * _BUCKET_BASE ** index
+
+
+def observe(name: str, value: float):
+    with _lock:
+        _histograms[name][_bucket(value)] += 1
+        _sums[name] += value
+
+
+def percentile(name: str, q: float) -> Optional[float]:
+    buckets = _histograms.get(name)
+    total = sum(buckets.values()) if buckets else 0
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index in sorted(buckets):
+        seen += buckets[index]
+        if seen >= rank:
+            return bucket_upper(index)
+    return bucket_upper(max(buckets))
+
+
+def metrics() -> Dict[str, Any]:
+    with _lock:
+        return {"counters": dict(_counters), "gauges": _all_gauges(), "sums": dict(_sums),
+                "histograms": {name: dict(buckets) for name, buckets in _histograms.items()}}
+
+
+def drain() -> Dict[str, Any]:
+    """Counters, sums and histograms since the last drain, plus the current value of every gauge."""
+    with _lock:
+        delta = {"counters": dict(_counters), "gauges": dict(_gauges), "sums": dict(_sums),
+                 "histograms": {name: dict(buckets) for name, buckets in _histograms.items()}}
+        _counters.clear()
+        _sums.clear()
+        _histograms.clear()
+    return delta
+
+
+def merge(delta: Dict[str, Any], source: Any = None):
+    """Add a drained delta; with a source, its gauges replace that source's previous report."""
+    with _lock:
+        _counters.update(delta["counters"])
+        _sums.update(delta["sums"])
+        for name, buckets in delta["histograms"].items():
+            _histograms[name].update(buckets)
+        if source is not None:
+            _source_gauges[source] = delta["gauges"]
+
+
+def summary() -> str:
+    return ", ".join(f"{name}={value}" for name, value in sorted(_counters.items()))
+
+
+def snapshot(quantiles: List[float] = (0.5, 0.95, 0.99)) -> Dict[str, Any]:
+    return {
+        "counters": dict(_counters),
+        "gauges": _all_gauges(),
+        "percentiles": {name: {f"p{int(q * 100)}": percentile(name, q) for q in quantiles}
+                        for name in _histograms},
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_child_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def write(path: str):
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=4)
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+import stats
+
+_METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_tracing = False
+_events: List[Tuple] = []
+_task_lanes: "weakref.WeakKeyDictionary[asyncio.Task, int]" = weakref.WeakKeyDictionary()
+_thread_lanes: Dict[int, int] = {}
+_next_lane = 0
+
+
+def _reset_after_fork():
+    _events.clear()
+    _thread_lanes.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def enable_tracing():
+    global _tracing
+    _tracing = True
+
+
+def _lane() -> int:
+    global _next_lane
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    lanes, key = (_task_lanes, task) if task is not None else (_thread_lanes, threading.get_ident())
+    lane = lanes.get(key)
+    if lane is None:
+        _next_lane += 1
+        lane = lanes[key] = _next_lane
+    return lane
+
+
+class span:
+    __slots__ = ("name", "args", "started")
+
+    def __init__(self, name: str, **args: Any):
+        self.name = name
+        self.args = args
+        self.started = 0.0
+
+    def __enter__(self) -> "span":
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.monotonic() - self.started
+        stats.observe(f"stage_{self.name}", duration)
+        if _tracing:
+            args = dict(self.args, error=exc_type.__name__) if exc_type is not None else self.args
+            _events.append((self.name, self.started, duration, os.getpid(), _lane(), args))
+
+
+def drain() -> List[Tuple]:
+    events = _events[:]
+    del _events[:len(events)]
+    return events
+
+
+def merge(events: List[Tuple]):
+    _events.extend(events)
+
+
+def write_trace(path: str):
+    with open(path, 'w') as f:
+        f.write('{"displayTimeUnit": "ms", "traceEvents": [')
+        for i, (name, started, duration, pid, lane, args) in enumerate(_events):
+            f.write(",\n" if i else "\n")
+            f.write(json.dumps({"name": name, "cat": "stage", "ph": "X", "ts": round(started * 1e6),
+                                "dur": round(duration * 1e6), "pid": pid, "tid": lane, "args": args},
+                               default=str))
+        f.write("\n]}\n")
+    print(f"Wrote {len(_events)} trace events to {path}")
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def render_metrics() -> str:
+    metrics = stats.metrics()
+    lines = []
+    for name, value in sorted(metrics["counters"].items()):
+        name = _metric_name(name)
+        lines += [f"# TYPE {name}_total counter", f"{name}_total {value}"]
+    for name, value in sorted(metrics["gauges"].items()):
+        name = _metric_name(name)
+        lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    for name, buckets in sorted(metrics["histograms"].items()):
+        metric = f"{_metric_name(name)}_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        # Every scrape lists the same le bounds; each fine stats bucket counts toward the first
+        # bound at or above its upper edge.
+        uppers = sorted((stats.bucket_upper(index), count) for index, count in buckets.items())
+        seen = position = 0
+        for le in _METRIC_BUCKETS:
+            while position < len(uppers) and uppers[position][0] <= le * (1 + 1e-9):
+                seen += uppers[position][1]
+                position += 1
+            lines.append(f'{metric}_bucket{{le="{le:g}"}} {seen}')
+        total = sum(buckets.values())
+        lines += [f'{metric}_bucket{{le="+Inf"}} {total}', f"{metric}_sum {metrics['sums'].get(name, 0.0)}",
+                  f"{metric}_count {total}"]
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,136 @@
+import bisect
+import contextlib
+import contextvars
+import json
+import os
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import stats
+
+_KEY_PREFIX = '{"key": "'
+_KEY_LENGTH = 64
+_HEADER_BYTES = 1024
+_decoder = json.JSONDecoder()
+_scope: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("transcript_scope", default=None)
+
+Slot = Tuple[Optional[str], str]
+
+
+@contextlib.contextmanager
+def scope(name: Any) -> Iterator[None]:
+    token = _scope.set(None if name is None else str(name))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def current_scope() -> Optional[str]:
+    return _scope.get()
+
+
+class _Counter:
+    def __init__(self):
+        self._next: Dict[Slot, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def claim(self, slot: Slot) -> int:
+        with self._lock:
+            sample = self._next[slot]
+            self._next[slot] += 1
+        return sample
+
+
+class TranscriptMiss(KeyError):
+    pass
+
+
+class TranscriptRecorder:
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._samples = _Counter()
+
+    def claim(self, key: str) -> int:
+        return self._samples.claim((current_scope(), key))
+
+    def record(self, key: str, sample: int, model: str, messages: List[Dict[str, str]], temperature: float,
+               max_new_tokens: int, response: str):
+        line = json.dumps({"key": key, "scope": current_scope(), "sample": sample, "model": model,
+                           "temperature": temperature, "max_new_tokens": max_new_tokens,
+                           "messages": messages, "response": response}, ensure_ascii=False) + "\n"
+        data = line.encode("utf-8")
+        os.write(self._fd, data)
+        stats.incr("transcript_bytes", len(data))
+
+    def close(self):
+        os.close(self._fd)
+
+
+def _header(line: bytes) -> Tuple[str, Optional[str], Optional[int]]:
+    key = line[len(_KEY_PREFIX):len(_KEY_PREFIX) + _KEY_LENGTH].decode("ascii")
+    head = line[:_HEADER_BYTES].decode("utf-8", "ignore")
+    position = len(_KEY_PREFIX) + _KEY_LENGTH + 1
+    if not head.startswith(', "scope": ', position):
+        return key, None, None
+    try:
+        name, position = _decoder.raw_decode(head, position + len(', "scope": '))
+        sample, _ = _decoder.raw_decode(head, position + len(', "sample": '))
+    except json.JSONDecodeError:
+        entry = json.loads(line)
+        name, sample = entry.get("scope"), entry.get("sample")
+    return key, name, sample
+
+
+class TranscriptReplay:
+    """Serves recorded responses by request key without touching the network.
+
+    Only the header of each line is read when the index is built; responses
+    are read with pread on demand. Requests are matched within their scope
+    (the item being processed, or a shared seed group), and the n-th identical
+    request of a scope gets the response recorded as its n-th dispatch, so
+    concurrent items, retries and duplicate prompts replay the same way.
+    Transcripts recorded without scopes fall back to per-key order.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._offsets: Dict[Slot, Dict[int, Tuple[int, int]]] = defaultdict(dict)
+        self._samples = _Counter()
+        offset = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if line.endswith(b"\n") and line.startswith(_KEY_PREFIX.encode()):
+                    key, name, sample = _header(line)
+                    recorded = self._offsets[(name, key)]
+                    recorded[len(recorded) if sample is None else sample] = (offset, len(line))
+                offset += len(line)
+        self._fd = os.open(path, os.O_RDONLY)
+
+    def __len__(self) -> int:
+        return sum(len(offsets) for offsets in self._offsets.values())
+
+    def _locate(self, key: str) -> Optional[Tuple[int, int]]:
+        slot = (current_scope(), key)
+        if slot not in self._offsets:
+            slot = (None, key)
+        sample = self._samples.claim(slot)
+        recorded = self._offsets.get(slot)
+        if not recorded:
+            return None
+        samples = sorted(recorded)
+        return recorded[samples[min(bisect.bisect_left(samples, sample), len(samples) - 1)]]
+
+    def get(self, key: str) -> str:
+        location = self._locate(key)
+        if location is None:
+            stats.incr("replay_misses")
+            raise TranscriptMiss(f"no recorded response for request {key}")
+        offset, length = location
+        stats.incr("replay_hits")
+        return json.loads(os.pread(self._fd, length, offset))["response"]
+
+    def close(self):
+        os.close(self._fd)